@@ -0,0 +1,107 @@
+import cv2
+import numpy as np
+
+from config import ANNOTATION_GRID_CELL_SIZE
+
+
+def _contour_extent(contour: np.ndarray | None) -> tuple[int, int, int, int] | None:
+    if contour is None or len(contour) == 0:
+        return None
+    x, y, w, h = cv2.boundingRect(contour)
+    return (x, y, x + w, y + h)
+
+
+class AnnotationIndex:
+    """id -> annotation map plus a sparse grid of z-ordered contour candidates for one annotation list.
+
+    A click only tests the few contours whose bounding box covers its grid cell, topmost first, so hit-testing
+    no longer scales with the number of objects. Geometry edits must be reported through `update`.
+    """
+
+    def __init__(self, annotations: list[dict], cell_size: int = ANNOTATION_GRID_CELL_SIZE):
+        self.annotations = annotations
+        self.cell_size = cell_size
+        self._by_id: dict[int, dict] = {}
+        self._z: dict[int, int] = {}
+        self._extents: dict[int, tuple[int, int, int, int]] = {}
+        self._cells: dict[tuple[int, int], list[int]] = {}
+        for z, annot in enumerate(annotations):
+            self._by_id[annot['id']] = annot
+            self._z[annot['id']] = z
+            self._insert(annot)
+
+    def is_current_for(self, annotations: list[dict]) -> bool:
+        return annotations is self.annotations and len(annotations) == len(self._by_id)
+
+    def get(self, obj_id: int) -> dict | None:
+        return self._by_id.get(obj_id)
+
+    def hit_test(self, x: int, y: int) -> dict | None:
+        """Topmost annotation whose contour contains (x, y), matching a reversed linear scan."""
+        for obj_id in reversed(self._cells.get((x // self.cell_size, y // self.cell_size), ())):
+            x0, y0, x1, y1 = self._extents[obj_id]
+            if not (x0 <= x < x1 and y0 <= y < y1):
+                continue
+            annot = self._by_id[obj_id]
+            if cv2.pointPolygonTest(annot['contour'], (x, y), False) >= 0:
+                return annot
+        return None
+
+    def update(self, annot: dict) -> None:
+        """Re-indexes one annotation after its contour moved, was scaled or was re-segmented."""
+        self._remove_cells(annot['id'])
+        self._insert(annot)
+
+    def clone(self, annotations: list[dict]) -> "AnnotationIndex":
+        """Index for a same-order copy of this list with new ids, reusing the grid instead of rebuilding it."""
+        id_map = {old['id']: new['id'] for old, new in zip(self.annotations, annotations)}
+        index = AnnotationIndex.__new__(AnnotationIndex)
+        index.annotations = annotations
+        index.cell_size = self.cell_size
+        index._by_id = {a['id']: a for a in annotations}
+        index._z = {id_map[old_id]: z for old_id, z in self._z.items()}
+        index._extents = {id_map[old_id]: extent for old_id, extent in self._extents.items()}
+        index._cells = {cell: [id_map[i] for i in ids] for cell, ids in self._cells.items()}
+        return index
+
+    def _cell_range(self, extent: tuple[int, int, int, int]):
+        x0, y0, x1, y1 = extent
+        for cy in range(y0 // self.cell_size, (y1 - 1) // self.cell_size + 1):
+            for cx in range(x0 // self.cell_size, (x1 - 1) // self.cell_size + 1):
+                yield cx, cy
+
+    def _insert(self, annot: dict) -> None:
+        extent = _contour_extent(annot.get('contour'))
+        if extent is None:
+            return
+        obj_id, z = annot['id'], self._z[annot['id']]
+        self._extents[obj_id] = extent
+        for cell in self._cell_range(extent):
+            ids = self._cells.setdefault(cell, [])
+            # Keep each cell sorted by list position so the last entry is the topmost object.
+            pos = len(ids)
+            while pos and self._z[ids[pos - 1]] > z:
+                pos -= 1
+            ids.insert(pos, obj_id)
+
+    def _remove_cells(self, obj_id: int) -> None:
+        extent = self._extents.pop(obj_id, None)
+        if extent is None:
+            return
+        for cell in self._cell_range(extent):
+            ids = self._cells.get(cell)
+            if ids is None:
+                continue
+            ids.remove(obj_id)
+            if not ids:
+                del self._cells[cell]
+
+
+def get_annotation_index(state: dict, image_type: str) -> AnnotationIndex:
+    """Returns the index of `state[f"{image_type}_annotations"]`, rebuilding it only when that list was replaced."""
+    annotations = state.get(f"{image_type}_annotations", [])
+    index = state.get(f"{image_type}_index")
+    if index is None or not index.is_current_for(annotations):
+        index = AnnotationIndex(annotations)
+        state[f"{image_type}_index"] = index
+    return index
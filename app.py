@@ -1,15 +1,17 @@
 import os
-import uuid
 import math
-from flask import Flask, render_template, request, jsonify, send_from_directory
+import time
+import uuid
+from flask import Flask, render_template, request, jsonify, send_from_directory, g, Response, abort
 from pyngrok import ngrok
 import json
 from PIL import Image, ImageDraw, ImageOps
 import numpy as np
 import cv2
 
-from gemini_edit import run_enhanced_ai_edit
+from gemini_edit import run_enhanced_ai_edit, ai_edit_cache
 from drawing import draw_circles_on_image
+from compositor import build_crude_collage
 try:
     from kaggle_secrets import UserSecretsClient
     KAGGLE_ENV = True
@@ -18,98 +20,342 @@ except ImportError:
     print("Kagle secrets not found. Assuming local environment.")
 
 import config
-from models import load_models
-from image_processing import run_detection_and_populate_editor, remove_background_and_add_border
+from models import start_background_loading, get_models, model_status
+from model_server import ModelClient, RemoteCacheStats
+from image_processing import (run_detection_and_populate_editor, run_batch_detection_and_populate_editors,
+                              remove_background_and_add_border, refine_object_mask, build_cutout_rgba,
+                              gd_result_cache, sam_embedding_cache)
+from session_store import SessionStore
+from asset_store import AssetStore
+from ingest import ingest_pair
+from jobs import JobScheduler, JobFailed, QueueFullError, INFERENCE, NETWORK
+from telemetry import registry, span, request_id_var, log_event, cache_collector, REQUESTS, REQUEST_SECONDS
 
 UPLOAD_FOLDER = 'uploads'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app = Flask(__name__, template_folder='templates')
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+# Sized for /detect_batch, the largest upload; limit_request_size holds every other route to one pair's worth.
+app.config['MAX_CONTENT_LENGTH'] = config.DETECT_BATCH_MAX_BYTES
+
+sessions = SessionStore()
+scheduler = JobScheduler()
+assets = AssetStore(UPLOAD_FOLDER, f"/{UPLOAD_FOLDER}")
+assets.start_sweeper()
+
+# With MODEL_SERVER_ADDRESS set, Grounding DINO and SAM live in a shared model_server.py process, so several
+# web processes can run without each loading the models. Otherwise models load on a background thread here;
+# inference jobs wait for them, and /ready reports progress.
+model_client = ModelClient(config.MODEL_SERVER_ADDRESS) if config.MODEL_SERVER_ADDRESS else None
+if model_client is None:
+    start_background_loading()
+
+# The model caches fill wherever inference runs; in model-server mode their stats are read from the server.
+for name, cache in (("gd_result", gd_result_cache), ("sam_embedding", sam_embedding_cache)):
+    registry.add_collector(cache_collector(name, RemoteCacheStats(model_client, name) if model_client else cache))
+registry.add_collector(cache_collector("ai_edit", ai_edit_cache))
+registry.add_collector(lambda: [
+    ("app_sessions", "gauge", "Live editor sessions.", {}, len(sessions)),
+    ("app_session_bytes", "gauge", "Estimated memory held by editor sessions.", {}, sessions.total_bytes()),
+    ("app_asset_dedup_hits_total", "counter", "Asset writes that reused an identical stored file.", {}, assets.dedup_hits),
+    ("app_models_ready", "gauge", "1 once the models are loaded.", {}, int(current_model_status()['ready'])),
+] + [("app_job_queue_depth", "gauge", "Jobs waiting or running per queue.", {"queue": kind}, depth)
+     for kind, depth in scheduler.queue_depths().items()])
+
+def current_model_status():
+    return model_client.status() if model_client else model_status()
+
+def local_models():
+    """In-process `(processor, model, predictor)`, or Nones when inference runs on the model server."""
+    return (None, None, None) if model_client else get_models()
+
+def save_cutout(staged_np, annot):
+    """Writes the RGBA cutout of one annotation (bbox crop, mask as alpha) and returns its path, URL and pixels."""
+    cutout_rgba = build_cutout_rgba(staged_np, annot)
+    cutout_filepath, cutout_url, _ = assets.put_image(Image.fromarray(cutout_rgba, 'RGBA'), "cutout")
+    return cutout_filepath, cutout_url, cutout_rgba
+
+@app.before_request
+def start_request_trace():
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    g.request_started = time.perf_counter()
+    request_id_var.set(g.request_id)
 
-print("Loading AI models, this might take a moment...")
-hf_gd_processor, hf_gd_model, sam_predictor = load_models()
-print("Models loaded successfully.")
+@app.before_request
+def limit_request_size():
+    limit = config.DETECT_BATCH_MAX_BYTES if request.endpoint == 'detect_batch' else config.REQUEST_MAX_BYTES
+    if (request.content_length or 0) > limit:
+        abort(413)
 
-def save_uploaded_file(file_storage):
-    if not file_storage: return None, None
-    filename = f"{uuid.uuid4()}_{os.path.basename(file_storage.filename)}"
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file_storage.save(filepath)
-    return filepath, f"/{UPLOAD_FOLDER}/{filename}"
+@app.after_request
+def finish_request_trace(response):
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    seconds = time.perf_counter() - g.get('request_started', time.perf_counter())
+    REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+    response.headers['X-Request-ID'] = g.get('request_id', '')
+    if endpoint not in ('/metrics', '/jobs/<job_id>', '/uploads/<filename>'):
+        log_event("request", method=request.method, endpoint=endpoint, status=response.status_code, seconds=round(seconds, 4))
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition of stage timings, request counters, cache hit rates, queue depths and memory."""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
     """Serves the main HTML page."""
-    return render_template('index.html', genai_available=config.GENAI_AVAILABLE)
+    return render_template('index.html', genai_available=config.GENAI_AVAILABLE or bool(config.GEMINI_API_BASE_URL))
+
+@app.route('/ready')
+def ready():
+    """Readiness probe: 200 once models are loaded, 503 while loading or after a load failure."""
+    status = current_model_status()
+    return jsonify(status), 200 if status['ready'] else 503
 
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
+    # Uploads are stored in the background; a request racing that write waits for it.
+    assets.wait_for(filename, timeout=30)
+    # Serving counts as use, so assets shown in an open editor are not swept.
+    assets.touch(filename)
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
-@app.route('/detect', methods=['POST'])
-def detect_objects():
-    if 'empty_image' not in request.files or 'staged_image' not in request.files:
-        return jsonify({'error': 'Missing images'}), 400
+def submit_job(kind, fn, *args):
+    """Queues a job and returns the 202 response the client polls on, or 429 when the queue is full."""
+    try:
+        job = scheduler.submit(kind, fn, *args)
+    except QueueFullError as e:
+        return jsonify({'error': str(e)}), 429
+    return jsonify({'job_id': job.id, 'status_url': f"/jobs/{job.id}", 'events_url': f"/jobs/{job.id}/events"}), 202
 
-    empty_path, empty_url = save_uploaded_file(request.files['empty_image'])
-    staged_path, _ = save_uploaded_file(request.files['staged_image'])
-    prompts = request.form.get('prompts', 'furniture, object')
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = scheduler.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found or expired.'}), 404
+    return jsonify(job.to_dict())
 
-    if not empty_path or not staged_path:
-        return jsonify({'error': 'Failed to save files'}), 500
+def format_sse(event, data, event_id):
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
 
-    empty_img_pil = Image.open(empty_path)
-    staged_img_pil = Image.open(staged_path).convert("RGB").resize(empty_img_pil.size)
-    staged_np = np.array(staged_img_pil)
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Streams a job's progress as Server-Sent Events, ending with a `finished` event carrying the job status.
 
-    staged_with_annotations_pil, _, _, _ = run_detection_and_populate_editor(
-        empty_path, staged_img_pil, prompts,
-        processor=hf_gd_processor, model=hf_gd_model, predictor=sam_predictor
-    )
-    
-    annotated_filename = f"annotated_{os.path.basename(staged_path)}"
-    annotated_filepath = os.path.join(app.config['UPLOAD_FOLDER'], annotated_filename)
-    staged_with_annotations_pil.save(annotated_filepath)
-    final_staged_url = f"/{UPLOAD_FOLDER}/{annotated_filename}"
+    Event ids are positions in the job's event list, so a reconnecting EventSource (which sends
+    `Last-Event-ID`) resumes where it left off instead of replaying everything.
+    """
+    job = scheduler.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found or expired.'}), 404
+    try:
+        position = int(request.headers.get('Last-Event-ID', -1)) + 1
+    except ValueError:
+        position = 0
 
-    remove_background_and_add_border()
-    
-    annotations = config.detection_results.get("staged_annotations", [])
+    def stream():
+        nonlocal position
+        while True:
+            events = job.events_after(position, timeout=config.JOB_EVENTS_KEEPALIVE_SECONDS)
+            for event, data in events:
+                yield format_sse(event, data, position)
+                position += 1
+            if job.done.is_set() and position >= len(job.events):
+                yield format_sse("finished", job.to_dict(), position)
+                return
+            if not events:
+                yield ": keepalive\n\n"
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    if not scheduler.cancel(job_id):
+        return jsonify({'error': 'Job not found or already finished.'}), 404
+    return jsonify(scheduler.get(job_id).to_dict())
+
+def publish_detection(session_id, state, empty_url, staged_with_annotations_pil, on_object=None):
+    """Writes the per-object cutouts and annotated image for a finished detection and builds the `/detect` response.
+
+    Cutouts are written first and each one is passed to `on_object` as soon as it is on disk, so a streaming
+    client can place objects before the (much larger) annotated image has been encoded.
+    """
+    annotations = state.get("staged_annotations", [])
+    staged_np = np.array(state["staged_image"])
     
     cutout_objects = []
     original_cutouts_by_id = {}
-    for annot in annotations:
-        mask = annot['mask']
-        x, y, w, h = annot['bbox']
-        
-        cutout_rgba = np.zeros((h, w, 4), dtype=np.uint8)
-        region_pixels = staged_np[y:y+h, x:x+w]
-        region_mask = mask[y:y+h, x:x+w]
-        
-        cutout_rgba[:, :, :3] = region_pixels
-        cutout_rgba[:, :, 3] = region_mask * 255
-        
-        cutout_pil = Image.fromarray(cutout_rgba, 'RGBA')
-        cutout_filename = f"cutout_{annot['id']}.png"
-        cutout_filepath = os.path.join(app.config['UPLOAD_FOLDER'], cutout_filename)
-        cutout_pil.save(cutout_filepath)
-        
-        original_cutouts_by_id[annot['id']] = cutout_filepath
-        
-        cutout_objects.append({
-            'url': f"/{UPLOAD_FOLDER}/{cutout_filename}",
-            'bbox': annot['bbox'],
-            'id': annot['id']
-        })
+    cutout_images_by_id = {}
+    with span("cutout_write", objects=len(annotations)):
+        for annot in annotations:
+            cutout_filepath, cutout_url, cutout_rgba = save_cutout(staged_np, annot)
+            original_cutouts_by_id[annot['id']] = cutout_filepath
+            cutout_images_by_id[annot['id']] = cutout_rgba
+
+            cutout_object = {
+                'url': cutout_url,
+                'bbox': annot['bbox'],
+                'id': annot['id']
+            }
+            cutout_objects.append(cutout_object)
+            if on_object:
+                on_object(cutout_object)
+
+    with span("annotated_png_write"):
+        _, final_staged_url, _ = assets.put_image(staged_with_annotations_pil, "annotated")
+
+    with span("remove_background"):
+        remove_background_and_add_border(state)
     
-    config.detection_results['original_cutouts_by_id'] = original_cutouts_by_id
+    state['original_cutouts_by_id'] = original_cutouts_by_id
+    # Decoded cutouts stay in the session so /run_ai composites without re-reading PNGs.
+    state['cutout_images_by_id'] = cutout_images_by_id
+    sessions.commit(session_id)
 
-    return jsonify({
+    return {
+        'session_id': session_id,
         'staged_image_url': final_staged_url, 
         'empty_image_url': empty_url,
         'objects': cutout_objects 
-    })
+    }
+
+@app.route('/detect', methods=['POST'])
+def detect_objects():
+    if 'empty_image' not in request.files or 'staged_image' not in request.files:
+        return jsonify({'error': 'Missing images'}), 400
+
+    # Decoded here, once, straight from the request; request threads decode in parallel ahead of the inference queue.
+    try:
+        empty_img_pil, staged_img_pil, empty_url = ingest_pair(request.files['empty_image'], request.files['staged_image'], assets)
+    except OSError:
+        return jsonify({'error': 'Could not read the uploaded images.'}), 400
+    prompts = request.form.get('prompts', 'furniture, object')
+    session_id, state = sessions.get_or_create(request.form.get('session_id'))
+
+    return submit_job(INFERENCE, detect_job, session_id, state, empty_img_pil, empty_url, staged_img_pil, prompts)
+
+def job_progress(job):
+    """Pipeline progress callback that forwards each stage name as a `stage` event on the job's stream."""
+    return lambda stage: job.emit("stage", {'stage': stage})
+
+def detect_job(job, session_id, state, empty_img_pil, empty_url, staged_img_pil, prompts):
+    job.emit("stage", {'stage': "loading_models"})
+    hf_gd_processor, hf_gd_model, sam_predictor = local_models()
+    # The empty room has the staged image's size, so clients can lay cutouts out on it while they stream in.
+    job.emit("session", {'session_id': session_id, 'empty_image_url': empty_url,
+                         'width': empty_img_pil.width, 'height': empty_img_pil.height})
+
+    staged_with_annotations_pil, _, _, _ = run_detection_and_populate_editor(
+        state, empty_img_pil, staged_img_pil, prompts,
+        processor=hf_gd_processor, model=hf_gd_model, predictor=sam_predictor, progress=job_progress(job),
+        model_client=model_client
+    )
+    job.raise_if_cancelled()
+
+    job.emit("stage", {'stage': "cutouts"})
+    return publish_detection(session_id, state, empty_url, staged_with_annotations_pil,
+                             on_object=lambda obj: job.emit("object", obj))
+
+@app.route('/detect_batch', methods=['POST'])
+def detect_batch():
+    """Detects objects for several empty/staged room pairs in one request, one new session per pair.
+
+    Expects `empty_images` and `staged_images` file lists of equal length, and either one `prompts`
+    value for all pairs or one per pair, at most `DETECT_BATCH_MAX_PAIRS` pairs. Returns a job id; the finished
+    job's result is `{'results': [...]}`.
+    """
+    empty_files = request.files.getlist('empty_images')
+    staged_files = request.files.getlist('staged_images')
+    if not empty_files or len(empty_files) != len(staged_files):
+        return jsonify({'error': 'Provide the same number of empty_images and staged_images.'}), 400
+    if len(empty_files) > config.DETECT_BATCH_MAX_PAIRS:
+        return jsonify({'error': f'At most {config.DETECT_BATCH_MAX_PAIRS} image pairs per batch.'}), 400
+
+    prompts_list = request.form.getlist('prompts') or ['furniture, object']
+    if len(prompts_list) == 1:
+        prompts_list = prompts_list * len(empty_files)
+    if len(prompts_list) != len(empty_files):
+        return jsonify({'error': 'Provide one prompts value, or one per image pair.'}), 400
+
+    empty_pils, empty_urls, staged_pils = [], [], []
+    for empty_file, staged_file in zip(empty_files, staged_files):
+        try:
+            empty_img_pil, staged_img_pil, empty_url = ingest_pair(empty_file, staged_file, assets)
+        except OSError:
+            return jsonify({'error': f"Could not read the images '{empty_file.filename}' / '{staged_file.filename}'."}), 400
+        empty_pils.append(empty_img_pil)
+        empty_urls.append(empty_url)
+        staged_pils.append(staged_img_pil)
+
+    return submit_job(INFERENCE, detect_batch_job, empty_pils, empty_urls, staged_pils, prompts_list)
+
+def detect_batch_job(job, empty_pils, empty_urls, staged_pils, prompts_list):
+    hf_gd_processor, hf_gd_model, sam_predictor = local_models()
+    sessions_and_states = [sessions.create() for _ in empty_pils]
+
+    batch_outputs = run_batch_detection_and_populate_editors(
+        [state for _, state in sessions_and_states], empty_pils, staged_pils, prompts_list,
+        processor=hf_gd_processor, model=hf_gd_model, predictor=sam_predictor, progress=job_progress(job),
+        model_client=model_client
+    )
+
+    job.raise_if_cancelled()
+
+    results = []
+    for (session_id, state), empty_url, (staged_with_annotations_pil, _, _, _) in zip(
+            sessions_and_states, empty_urls, batch_outputs):
+        results.append(publish_detection(session_id, state, empty_url, staged_with_annotations_pil))
+        job.emit("result", results[-1])
+
+    return {'results': results}
+
+@app.route('/refine_mask', methods=['POST'])
+def refine_mask_endpoint():
+    """Refines one object's mask from extra point/box prompts using the cached SAM embedding."""
+    data = request.json
+    if not data or data.get('id') is None:
+        return jsonify({'error': 'Missing object id in request.'}), 400
+
+    session_id = data.get('session_id')
+    state = sessions.get(session_id)
+    if state is None:
+        return jsonify({'error': 'Session expired or not found. Please run detection again.'}), 404
+
+    # Decoding from a cached embedding is fast, so wait for the shared inference worker instead of returning a job id
+    try:
+        job = scheduler.submit(INFERENCE, refine_mask_job, session_id, state, data)
+    except QueueFullError as e:
+        return jsonify({'error': str(e)}), 429
+    if not job.wait(timeout=config.REFINE_WAIT_TIMEOUT_SECONDS):
+        scheduler.cancel(job.id)
+        return jsonify({'error': 'The inference queue is busy. Please retry shortly.'}), 503
+    if job.status != "done":
+        return jsonify({'error': job.error or f"Refinement {job.status}."}), 400
+    return jsonify(job.result)
+
+def refine_mask_job(job, session_id, state, data):
+    _, _, sam_predictor = local_models()
+    annot = refine_object_mask(
+        state, int(data['id']), sam_predictor,
+        point_coords=data.get('points'), point_labels=data.get('point_labels'), box=data.get('box'),
+        model_client=model_client, checkpoint=job.raise_if_cancelled
+    )
+    if annot is None:
+        raise JobFailed(f"Could not refine object with ID {data['id']}.")
+
+    cutout_filepath, cutout_url, cutout_rgba = save_cutout(np.array(state['staged_image']), annot)
+    state['original_cutouts_by_id'][annot['id']] = cutout_filepath
+    state.setdefault('cutout_images_by_id', {})[annot['id']] = cutout_rgba
+    sessions.commit(session_id)
+
+    return {
+        # Cutouts are content-addressed, so a refined mask gets a new URL and needs no cache busting
+        'url': cutout_url,
+        'bbox': annot['bbox'],
+        'id': annot['id']
+    }
 
 @app.route('/run_ai', methods=['POST'])
 def run_ai_edit_endpoint():
@@ -119,74 +365,50 @@ def run_ai_edit_endpoint():
 
     final_objects = data.get('objects', [])
     user_prompt = data.get('user_prompt', 'Make the final image photorealistic.')
+    # Identical layouts and prompts reuse the stored result unless the client asks for a fresh generation.
+    regenerate = bool(data.get('regenerate', False))
+
+    state = sessions.get(data.get('session_id'))
+    if state is None:
+        return jsonify({'error': 'Session expired or not found. Please run detection again.'}), 404
 
-    empty_room_img = config.detection_results.get("empty_image")
+    empty_room_img = state.get("empty_image")
     if not empty_room_img:
         return jsonify({'error': 'Base images not found. Please run detection first.'}), 400
 
-    original_cutouts_by_id = config.detection_results.get("original_cutouts_by_id", {})
+    original_cutouts_by_id = state.get("original_cutouts_by_id", {})
     if not original_cutouts_by_id:
         return jsonify({'error': 'Cutout object data not found. Please run detection first.'}), 400
-        
-    # Create the "Crude Collage" by starting with the empty room
-    crude_collage_img = empty_room_img.copy().convert("RGBA")
 
-    canvas_width = 800 
-    scale_factor = empty_room_img.width / canvas_width
+    cutout_images_by_id = state.setdefault('cutout_images_by_id', {})
+    for obj_id, cutout_path in original_cutouts_by_id.items():
+        if obj_id not in cutout_images_by_id:
+            try:
+                cutout_images_by_id[obj_id] = np.array(Image.open(cutout_path).convert("RGBA"))
+            except FileNotFoundError:
+                continue
 
+    return submit_job(NETWORK, run_ai_job, empty_room_img, dict(cutout_images_by_id), final_objects, user_prompt, regenerate)
+
+def run_ai_job(job, empty_room_img, cutout_images_by_id, final_objects, user_prompt, regenerate=False):
     # The order of objects in final_objects from fabric.js respects the layering (last is on top)
-    for obj_data in final_objects:
-        obj_id = obj_data.get('id')
-        if obj_id is None: continue
-        
-        cutout_path = original_cutouts_by_id.get(obj_id)
-        if not cutout_path: continue
-        
-        try:
-            furniture_piece_img = Image.open(cutout_path).convert("RGBA")
-        except FileNotFoundError:
-            continue
-            
-        unscaled_left = int(obj_data['left'] * scale_factor)
-        unscaled_top = int(obj_data['top'] * scale_factor)
-        unscaled_width = int(obj_data['width'] * scale_factor)
-        unscaled_height = int(obj_data['height'] * scale_factor)
-        
-        if unscaled_width <= 0 or unscaled_height <= 0: continue
-
-        piece = furniture_piece_img.resize((unscaled_width, unscaled_height), Image.Resampling.LANCZOS)
-
-        if obj_data.get('flipX'):
-            piece = piece.transpose(Image.FLIP_LEFT_RIGHT)
-        
-        angle_deg = obj_data.get('angle', 0)
-        piece = piece.rotate(-angle_deg, expand=True, resample=Image.BICUBIC)
-
-        # Calculate final paste position, accounting for rotation changing the image size
-        paste_x = int(unscaled_left + (unscaled_width - piece.width) / 2)
-        paste_y = int(unscaled_top + (unscaled_height - piece.height) / 2)
-        
-        # Paste the transformed furniture piece directly onto the collage
-        # Using the piece's own alpha channel ensures transparency is handled correctly
-        crude_collage_img.paste(piece, (paste_x, paste_y), piece)
-
-    # Convert back to RGB for the model
-    crude_collage_img = crude_collage_img.convert("RGB")
+    with span("collage_composite", objects=len(final_objects)):
+        crude_collage_img = build_crude_collage(empty_room_img, cutout_images_by_id, final_objects)
+    job.raise_if_cancelled()
 
     result_image, status_message = run_enhanced_ai_edit(
         crude_collage_img,            
-        user_prompt
+        user_prompt,
+        regenerate=regenerate
     )
 
     if result_image is None:
-        return jsonify({'error': status_message}), 500
+        raise JobFailed(status_message)
 
-    result_filename = f"result_{uuid.uuid4()}.png"
-    result_filepath = os.path.join(app.config['UPLOAD_FOLDER'], result_filename)
-    result_image.save(result_filepath)
-    result_url = f"/{UPLOAD_FOLDER}/{result_filename}"
+    with span("result_png_write"):
+        _, result_url, _ = assets.put_image(result_image, "result")
 
-    return jsonify({'result_image_url': result_url, 'status': status_message})
+    return {'result_image_url': result_url, 'status': status_message}
 
 
 if __name__ == '__main__':
@@ -0,0 +1,191 @@
+import hashlib
+import io
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from config import ASSET_STORE_MAX_BYTES, ASSET_TTL_SECONDS, ASSET_SWEEP_INTERVAL_SECONDS
+
+_ALLOWED_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif", ".tif", ".tiff"}
+
+
+def _new_digest():
+    return hashlib.blake2b(digest_size=16)
+
+
+def _extension(filename: str | None, default: str = ".png") -> str:
+    ext = os.path.splitext(filename or "")[1].lower()
+    return ext if ext in _ALLOWED_EXTENSIONS else default
+
+
+class AssetStore:
+    """Content-addressed file store behind `/uploads/<filename>`, bounded by a byte budget and an idle TTL.
+
+    Files are named `<kind>_<blake2b of the bytes><ext>`, so identical uploads and re-rendered images share
+    one file and the hash doubles as a cache key. Access (write or serve) refreshes a file's mtime; the sweeper
+    deletes files idle past the TTL, then the least recently used ones until the folder fits the budget.
+    """
+
+    def __init__(self, folder: str, url_prefix: str, max_bytes: int = ASSET_STORE_MAX_BYTES,
+                 ttl_seconds: float = ASSET_TTL_SECONDS):
+        self.folder = folder
+        self.url_prefix = url_prefix.rstrip("/")
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.dedup_hits = 0
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self._stop = threading.Event()
+        # Filenames handed out by put_upload_async whose bytes are still being written.
+        self._pending: dict[str, threading.Event] = {}
+        self._writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="asset-writer")
+        os.makedirs(folder, exist_ok=True)
+
+    def url_for(self, filename: str) -> str:
+        return f"{self.url_prefix}/{filename}"
+
+    def put_upload_async(self, data: bytes, filename: str | None, kind: str = "upload") -> tuple[str, str, str]:
+        """Stores an upload already read into memory (see ingest.py); the write happens on a background thread.
+
+        The path and URL are known from the hash up front; `wait_for` blocks until the file has landed.
+        """
+        ext = _extension(filename)
+        digest = _new_digest()
+        digest.update(data)
+        content_hash = digest.hexdigest()
+        stored_name = f"{kind}_{content_hash}{ext}"
+        path = os.path.join(self.folder, stored_name)
+        if self._touch(path):
+            self.dedup_hits += 1
+            return path, self.url_for(stored_name), content_hash
+        with self._lock:
+            if stored_name not in self._pending:
+                self._pending[stored_name] = threading.Event()
+                self._writer.submit(self._write_pending, data, content_hash, kind, ext, stored_name)
+        return path, self.url_for(stored_name), content_hash
+
+    def _write_pending(self, data: bytes, content_hash: str, kind: str, ext: str, stored_name: str) -> None:
+        try:
+            self._put_bytes(data, content_hash, kind, ext)
+        except Exception as e:
+            print(f"Asset write failed for {stored_name}: {e}")
+        finally:
+            with self._lock:
+                done = self._pending.pop(stored_name)
+            done.set()
+
+    def wait_for(self, filename: str, timeout: float | None = None) -> None:
+        """Blocks until a pending `put_upload_async` write of `filename` has finished; returns at once otherwise."""
+        with self._lock:
+            pending = self._pending.get(os.path.basename(filename))
+        if pending is not None:
+            pending.wait(timeout)
+
+    def put_bytes(self, data: bytes, kind: str, ext: str = ".png") -> tuple[str, str, str]:
+        digest = _new_digest()
+        digest.update(data)
+        return self._put_bytes(data, digest.hexdigest(), kind, ext)
+
+    def _put_bytes(self, data: bytes, content_hash: str, kind: str, ext: str) -> tuple[str, str, str]:
+        filename = f"{kind}_{content_hash}{ext}"
+        path = os.path.join(self.folder, filename)
+        if self._touch(path):
+            return path, self.url_for(filename), content_hash
+        tmp_path = os.path.join(self.folder, f".tmp_{uuid.uuid4().hex}")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        return self._commit(tmp_path, content_hash, kind, ext)
+
+    def put_image(self, image: Image.Image, kind: str, image_format: str = "PNG") -> tuple[str, str, str]:
+        """Encodes a PIL image and stores it under its content hash. Returns (path, url, content hash)."""
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format)
+        return self.put_bytes(buffer.getvalue(), kind, "." + image_format.lower())
+
+    def touch(self, filename: str) -> bool:
+        """Marks a file as recently used so the sweeper keeps it; returns False if it no longer exists."""
+        return self._touch(os.path.join(self.folder, os.path.basename(filename)))
+
+    def _touch(self, path: str) -> bool:
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _commit(self, tmp_path: str, content_hash: str, kind: str, ext: str) -> tuple[str, str, str]:
+        filename = f"{kind}_{content_hash}{ext}"
+        path = os.path.join(self.folder, filename)
+        with self._lock:
+            if self._touch(path):
+                os.remove(tmp_path)
+                self.dedup_hits += 1
+            else:
+                # Atomic rename: readers never see a partially written asset.
+                os.replace(tmp_path, path)
+        return path, self.url_for(filename), content_hash
+
+    def _entries(self) -> list[tuple[float, int, str]]:
+        entries = []
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def sweep(self, now: float | None = None) -> dict[str, int]:
+        """Deletes expired files, then the least recently used ones while the folder exceeds its byte budget."""
+        now = time.time() if now is None else now
+        removed = freed = 0
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for mtime, size, path in entries:
+                # Temporary files belong to in-flight writes; only reap ones that were clearly abandoned.
+                expired = now - mtime > self.ttl_seconds
+                if not expired and total <= self.max_bytes:
+                    break
+                if not expired and os.path.basename(path).startswith(".tmp_"):
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+                freed += size
+        if removed:
+            print(f"Asset sweep removed {removed} files ({freed / 1024 ** 2:.1f} MiB).")
+        return {"removed": removed, "freed_bytes": freed}
+
+    def stats(self) -> dict[str, int]:
+        entries = self._entries()
+        return {"files": len(entries), "bytes": sum(size for _, size, _ in entries), "dedup_hits": self.dedup_hits}
+
+    def start_sweeper(self, interval_seconds: float = ASSET_SWEEP_INTERVAL_SECONDS) -> None:
+        """Runs `sweep` on a daemon thread every `interval_seconds`."""
+        if self._sweeper is not None:
+            return
+
+        def loop():
+            while not self._stop.wait(interval_seconds):
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"Asset sweep failed: {e}")
+
+        self.sweep()
+        self._sweeper = threading.Thread(target=loop, name="asset-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self) -> None:
+        self._stop.set()
@@ -0,0 +1,322 @@
+"""Runs detection, cutouts and the crude collage over a manifest of room pairs, without the web app.
+
+Decoding, diffing and all file writes run in a pool of worker processes; this process owns the models and
+batches Grounding DINO and SAM across pairs. Each item gets a folder under --out with its cutouts, the
+annotated image, the collage and a report.json. Finished items are appended to <out>/checkpoint.jsonl, so
+re-running the same command after an interruption skips them and retries only failed or unfinished items.
+
+The manifest is JSON Lines (or CSV with a header row) with `empty`, `staged` and optional `prompts`, `layout`
+and `id` fields; relative paths are resolved against the manifest's folder. Items without an `id` are named
+by row number, so give ids if the manifest may be reordered between runs. `layout` is a JSON file holding
+the editor's object list as sent to /run_ai (`id`, `left`, `top`, `width`, `height`, `angle`, `flipX` in
+800 px canvas coordinates), or `{"objects": [...], "canvas_width": N}`; object ids match report.json.
+Without a layout every object stays where it was detected.
+
+Usage:
+    python batch_pipeline.py manifest.jsonl --out batch_out --workers 8 --batch-size 4
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+from compositor import build_crude_collage
+from config import GD_BATCH_SIZE, MAX_INFERENCE_SIDE, ROI_DETECTION
+from drawing import draw_contours_with_selection
+from image_processing import prepare_detection_input, segment_prepared_inputs, build_cutout_rgba
+from ingest import decode_image
+from models import load_models
+from session_store import new_session_state
+
+CHECKPOINT_FILE = "checkpoint.jsonl"
+# Width of the editor canvas that layout coordinates refer to (see build_crude_collage).
+EDITOR_CANVAS_WIDTH = 800
+
+
+def read_manifest(path: str) -> list[dict]:
+    base = os.path.dirname(os.path.abspath(path))
+
+    def resolve(p):
+        return p if os.path.isabs(p) else os.path.join(base, p)
+
+    with open(path, newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    items, seen = [], set()
+    for n, row in enumerate(rows, start=1):
+        if not row.get("empty") or not row.get("staged"):
+            raise ValueError(f"Manifest row {n} needs 'empty' and 'staged' paths.")
+        item_id = str(row.get("id") or f"{n:06d}").replace(os.sep, "_")
+        if item_id in seen:
+            raise ValueError(f"Manifest row {n} repeats id '{item_id}'.")
+        seen.add(item_id)
+        items.append({
+            "id": item_id,
+            "empty": resolve(row["empty"]),
+            "staged": resolve(row["staged"]),
+            "prompts": row.get("prompts") or "furniture, object",
+            "layout": resolve(row["layout"]) if row.get("layout") else None,
+        })
+    return items
+
+
+def read_checkpoint(out_dir: str) -> set[str]:
+    """Ids whose latest checkpoint entry is "done"; a line cut short by an interruption is ignored."""
+    status = {}
+    try:
+        with open(os.path.join(out_dir, CHECKPOINT_FILE)) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                status[entry["id"]] = entry["status"]
+    except FileNotFoundError:
+        pass
+    return {item_id for item_id, s in status.items() if s == "done"}
+
+
+def load_pair(item: dict) -> tuple[Image.Image, Image.Image]:
+    """Decodes a pair the way /detect does: the staged photo is resized to the empty room's size."""
+    empty_img_pil = decode_image(item["empty"])
+    return empty_img_pil, decode_image(item["staged"], empty_img_pil.size)
+
+
+def load_layout(path: str | None, annotations: list[dict], image_width: int) -> tuple[list[dict], int]:
+    if path is None:
+        return [{'id': a['id'], 'left': a['bbox'][0], 'top': a['bbox'][1], 'width': a['bbox'][2], 'height': a['bbox'][3]}
+                for a in annotations], image_width
+    with open(path) as f:
+        layout = json.load(f)
+    if isinstance(layout, dict):
+        return layout.get("objects", []), layout.get("canvas_width", EDITOR_CANVAS_WIDTH)
+    return layout, EDITOR_CANVAS_WIDTH
+
+
+def write_json(path: str, data: dict) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _init_worker():
+    # Workers run side by side; one thread each avoids oversubscribing the cores.
+    cv2.setNumThreads(1)
+    torch.set_num_threads(1)
+
+
+def prepare_item(item: dict, max_side: int | None) -> tuple[dict, np.ndarray, np.ndarray, dict]:
+    """Worker: decode and diff one pair.
+
+    Returns the inference-size inputs, the full-resolution empty and staged pixels (kept for `write_item`, so the
+    pair is decoded only once) and stage timings.
+    """
+    start = time.perf_counter()
+    empty_img_pil, staged_img_pil = load_pair(item)
+    decoded = time.perf_counter()
+    prepared = prepare_detection_input(empty_img_pil, staged_img_pil, item["prompts"], max_side)
+    # Same pixels as `staged_np`; the model process rebuilds it instead of receiving them twice.
+    del prepared["infer_pil"]
+    timings = {"decode": decoded - start, "diff": time.perf_counter() - decoded}
+    return prepared, np.asarray(empty_img_pil), np.asarray(staged_img_pil), timings
+
+
+def write_item(item: dict, annotations: list[dict], empty_np: np.ndarray, staged_np: np.ndarray, out_dir: str,
+               timings: dict) -> dict:
+    """Worker: writes the cutouts, annotated image, collage and report.json for one detected pair."""
+    item_dir = os.path.join(out_dir, item["id"])
+    os.makedirs(item_dir, exist_ok=True)
+    empty_img_pil, staged_img_pil = Image.fromarray(empty_np), Image.fromarray(staged_np)
+
+    start = time.perf_counter()
+    objects, cutouts_by_id = [], {}
+    for annot in annotations:
+        cutout_rgba = build_cutout_rgba(staged_np, annot)
+        filename = f"cutout_{annot['id']}.png"
+        Image.fromarray(cutout_rgba).save(os.path.join(item_dir, filename))
+        cutouts_by_id[annot['id']] = cutout_rgba
+        objects.append({'id': annot['id'], 'bbox': list(annot['bbox']), 'color_name': annot['color_name'],
+                        'area': int(annot['mask'].area), 'cutout': filename})
+    timings["cutouts"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    draw_contours_with_selection(staged_img_pil, annotations).save(os.path.join(item_dir, "annotated.png"))
+    timings["annotated"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    layout, canvas_width = load_layout(item["layout"], annotations, empty_img_pil.width)
+    build_crude_collage(empty_img_pil, cutouts_by_id, layout, canvas_width).save(os.path.join(item_dir, "collage.png"))
+    timings["collage"] = time.perf_counter() - start
+
+    report = {
+        "id": item["id"], "status": "done", "inputs": item, "objects": objects,
+        "files": {"annotated": "annotated.png", "collage": "collage.png"},
+        "timings": {stage: round(seconds, 4) for stage, seconds in timings.items()},
+    }
+    write_json(os.path.join(item_dir, "report.json"), report)
+    return report
+
+
+class BatchRunner:
+    """Feeds manifest items through the worker pool and the in-process models, checkpointing each finished item."""
+
+    def __init__(self, out_dir: str, models: tuple, pool: ProcessPoolExecutor, workers: int, batch_size: int,
+                 max_side: int | None, roi: bool):
+        self.out_dir = out_dir
+        self.models = models
+        self.pool = pool
+        self.batch_size = batch_size
+        # Enough decodes in flight to keep the next batches ready while the models run; each holds its
+        # full-resolution pair until its outputs are written.
+        self.prefetch = 2 * batch_size + workers
+        self.max_side = max_side
+        self.roi = roi
+        self.results = {"done": 0, "failed": 0, "objects": 0}
+        self.stage_seconds: dict[str, float] = {}
+        self._checkpoint = open(os.path.join(out_dir, CHECKPOINT_FILE), "a")
+
+    def run(self, items: list[dict]) -> None:
+        pending = iter(items)
+        preparing: deque = deque()
+        writing = {}
+
+        def top_up():
+            while len(preparing) < self.prefetch:
+                item = next(pending, None)
+                if item is None:
+                    return
+                preparing.append((item, self.pool.submit(prepare_item, item, self.max_side)))
+
+        top_up()
+        while preparing or writing:
+            batch = [preparing.popleft() for _ in range(min(self.batch_size, len(preparing)))]
+            top_up()
+            if batch:
+                self._infer(batch, writing)
+            if writing:
+                finished, _ = wait(writing, timeout=0 if preparing else None, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    item = writing.pop(future)
+                    try:
+                        self._record(future.result())
+                    except Exception as e:
+                        self._fail(item, "write", e)
+        self._checkpoint.close()
+
+    def _infer(self, batch: list, writing: dict) -> None:
+        ready = []
+        for item, future in batch:
+            try:
+                prepared, empty_np, staged_np, timings = future.result()
+            except Exception as e:
+                self._fail(item, "decode", e)
+                continue
+            prepared["infer_pil"] = Image.fromarray(prepared["staged_np"])
+            ready.append((item, prepared, empty_np, staged_np, timings))
+        if not ready:
+            return
+
+        start = time.perf_counter()
+        try:
+            all_annotations = segment_prepared_inputs(
+                [new_session_state() for _ in ready], [entry[1] for entry in ready], *self.models, roi=self.roi
+            )
+        except Exception as e:
+            for item, *_ in ready:
+                self._fail(item, "inference", e)
+            return
+        # Batched stages are shared; each item is charged an equal share.
+        share = (time.perf_counter() - start) / len(ready)
+        for (item, _, empty_np, staged_np, timings), annotations in zip(ready, all_annotations):
+            timings["inference"] = share
+            future = self.pool.submit(write_item, item, annotations or [], empty_np, staged_np, self.out_dir, timings)
+            writing[future] = item
+
+    def _record(self, report: dict) -> None:
+        self.results["done"] += 1
+        self.results["objects"] += len(report["objects"])
+        for stage, seconds in report["timings"].items():
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+        print(f"[{report['id']}] done: {len(report['objects'])} objects")
+        self._write_checkpoint({"id": report["id"], "status": "done", "objects": len(report["objects"])})
+
+    def _fail(self, item: dict, stage: str, error: Exception) -> None:
+        self.results["failed"] += 1
+        message = f"{type(error).__name__}: {error}"
+        print(f"[{item['id']}] failed during {stage}: {message}")
+        item_dir = os.path.join(self.out_dir, item["id"])
+        os.makedirs(item_dir, exist_ok=True)
+        write_json(os.path.join(item_dir, "report.json"),
+                   {"id": item["id"], "status": "failed", "stage": stage, "error": message, "inputs": item})
+        self._write_checkpoint({"id": item["id"], "status": "failed", "error": message})
+
+    def _write_checkpoint(self, entry: dict) -> None:
+        self._checkpoint.write(json.dumps(entry) + "\n")
+        self._checkpoint.flush()
+        os.fsync(self._checkpoint.fileno())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("manifest")
+    parser.add_argument("--out", default="batch_out")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="Processes for decoding, diffing and writing outputs.")
+    parser.add_argument("--batch-size", type=int, default=GD_BATCH_SIZE, help="Pairs per Grounding DINO/SAM batch.")
+    parser.add_argument("--max-side", type=int, default=MAX_INFERENCE_SIDE)
+    parser.add_argument("--roi", action=argparse.BooleanOptionalAction, default=ROI_DETECTION,
+                        help="Change-guided detection (defaults to ROI_DETECTION).")
+    args = parser.parse_args()
+
+    items = read_manifest(args.manifest)
+    os.makedirs(args.out, exist_ok=True)
+    done = read_checkpoint(args.out)
+    pending = [item for item in items if item["id"] not in done]
+    print(f"{len(items) - len(pending)} of {len(items)} items already done; processing {len(pending)}.")
+    if not pending:
+        return
+
+    # Workers are spawned rather than forked so they never inherit the model-owning process's threads.
+    pool = ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker)
+    models = load_models()
+    runner = BatchRunner(args.out, models, pool, args.workers, args.batch_size, args.max_side, args.roi)
+
+    start = time.perf_counter()
+    try:
+        runner.run(pending)
+    except KeyboardInterrupt:
+        pool.shutdown(wait=False, cancel_futures=True)
+        print("Interrupted; run the same command again to resume.")
+        sys.exit(130)
+    pool.shutdown()
+    seconds = time.perf_counter() - start
+
+    summary = {**runner.results, "seconds": round(seconds, 2),
+               "items_per_second": round(runner.results["done"] / seconds, 3) if seconds else None,
+               "mean_stage_seconds": {stage: round(total / max(1, runner.results["done"]), 4)
+                                      for stage, total in runner.stage_seconds.items()}}
+    write_json(os.path.join(args.out, "summary.json"), summary)
+
+    print(f"\n{'stage':<18}{'mean s/item':>12}")
+    for stage, mean in summary["mean_stage_seconds"].items():
+        print(f"{stage:<18}{mean:>12.3f}")
+    print(f"\n{summary['done']} done, {summary['failed']} failed, {summary['objects']} objects "
+          f"in {seconds:.1f}s ({summary['items_per_second']} items/s)")
+
+
+if __name__ == "__main__":
+    main()
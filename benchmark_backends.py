@@ -0,0 +1,85 @@
+"""Compares inference backends against eager PyTorch on latency and output parity.
+
+Usage:
+    python benchmark_backends.py --image staged.jpg --prompts "sofa, lamp" --runs 3 --output backends.json
+"""
+import argparse
+import gc
+import json
+import statistics
+
+import numpy as np
+from PIL import Image
+
+from config import DEVICE, SAM_MODEL_TYPE, HF_GD_MODEL_ID
+from inference_backends import BACKENDS, apply_backend, run_probe, decode_masks, check_parity
+from models import load_eager_models
+
+
+def synthetic_room(width: int = 1024, height: int = 768) -> Image.Image:
+    rng = np.random.default_rng(0)
+    image = np.full((height, width, 3), 200, dtype=np.uint8)
+    image[int(height * 0.6):] = (150, 120, 90)
+    for _ in range(4):
+        x, y = rng.integers(0, width - 200), rng.integers(int(height * 0.3), height - 150)
+        image[y:y + 150, x:x + 200] = rng.integers(0, 255, 3)
+    return Image.fromarray(image)
+
+
+def benchmark_backend(backend: str, image: Image.Image, text_prompt: str, runs: int, reference: dict | None):
+    processor, model, predictor = apply_backend(*load_eager_models(), backend)
+    run_probe(processor, model, predictor, image, text_prompt)  # warm-up (compilation, ONNX session init)
+
+    probes = [run_probe(processor, model, predictor, image, text_prompt) for _ in range(runs)]
+    last = probes[-1]
+    result = {
+        "backend": backend,
+        "gd_seconds_median": round(statistics.median(p["gd_seconds"] for p in probes), 4),
+        "sam_encode_seconds_median": round(statistics.median(p["sam_encode_seconds"] for p in probes), 4),
+        "num_boxes": len(last["boxes"]),
+    }
+    boxes = (reference or last)["boxes"]
+    masks = decode_masks(predictor, last["image_np"], boxes)
+    if reference is not None:
+        result.update(check_parity(reference, last, reference["masks"], masks))
+    return result, dict(last, masks=masks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", help="Staged room image; a synthetic room is used if omitted.")
+    parser.add_argument("--prompts", default="furniture, object")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="Comma-separated subset of: " + ", ".join(BACKENDS))
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--output", help="Write the report as JSON to this path.")
+    args = parser.parse_args()
+
+    image = Image.open(args.image).convert("RGB") if args.image else synthetic_room()
+    text_prompt = ". ".join(p.strip() for p in args.prompts.split(",") if p.strip()) + "."
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+
+    reference, results = None, []
+    # Eager always runs first: it is the parity reference for every other backend.
+    for backend in ["eager"] + [b for b in backends if b != "eager"]:
+        print(f"--- Benchmarking '{backend}' ---")
+        result, outputs = benchmark_backend(backend, image, text_prompt, args.runs, reference)
+        if reference is None:
+            reference = outputs
+        if backend in backends:
+            results.append(result)
+        gc.collect()
+
+    report = {"device": str(DEVICE), "gd_model": HF_GD_MODEL_ID, "sam_model_type": SAM_MODEL_TYPE,
+              "image_size": image.size, "runs": args.runs, "results": results}
+    print(f"\n{'backend':<10} {'GD s':>8} {'SAM enc s':>10} {'boxes':>6} {'box IoU':>8} {'mask IoU':>9} {'parity':>7}")
+    for r in results:
+        print(f"{r['backend']:<10} {r['gd_seconds_median']:>8.3f} {r['sam_encode_seconds_median']:>10.3f} {r['num_boxes']:>6} "
+              f"{r.get('box_iou', 1.0):>8.3f} {r.get('mask_iou', 1.0):>9.3f} {str(r.get('passed', True)):>7}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Times crude-collage compositing against object count: the in-memory affine compositor vs the previous PIL path.
+
+Usage:
+    python benchmark_compositor.py --width 4000 --height 3000 --counts 1,5,10,20,40 --output collage.json
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from compositor import build_crude_collage
+
+
+def pil_collage(empty_room_img, cutout_paths_by_id, final_objects, canvas_width=800):
+    """The previous compositing path: decode from disk, LANCZOS resize, flip, bicubic rotate, full-canvas paste."""
+    crude_collage_img = empty_room_img.copy().convert("RGBA")
+    scale_factor = empty_room_img.width / canvas_width
+    for obj_data in final_objects:
+        furniture_piece_img = Image.open(cutout_paths_by_id[obj_data['id']]).convert("RGBA")
+        unscaled_left = int(obj_data['left'] * scale_factor)
+        unscaled_top = int(obj_data['top'] * scale_factor)
+        unscaled_width = int(obj_data['width'] * scale_factor)
+        unscaled_height = int(obj_data['height'] * scale_factor)
+        piece = furniture_piece_img.resize((unscaled_width, unscaled_height), Image.Resampling.LANCZOS)
+        if obj_data.get('flipX'):
+            piece = piece.transpose(Image.FLIP_LEFT_RIGHT)
+        piece = piece.rotate(-obj_data.get('angle', 0), expand=True, resample=Image.BICUBIC)
+        paste_x = int(unscaled_left + (unscaled_width - piece.width) / 2)
+        paste_y = int(unscaled_top + (unscaled_height - piece.height) / 2)
+        crude_collage_img.paste(piece, (paste_x, paste_y), piece)
+    return crude_collage_img.convert("RGB")
+
+
+def synthetic_scene(width, height, count, rng, folder):
+    room = Image.fromarray(rng.integers(0, 255, (height, width, 3), dtype=np.uint8))
+    cutouts, paths, objects = {}, {}, []
+    for obj_id in range(1, count + 1):
+        w, h = int(rng.integers(width // 10, width // 4)), int(rng.integers(height // 10, height // 4))
+        # Flat colours: resampling filters differ between the two paths, so textured pieces would hide placement errors.
+        rgba = np.zeros((h, w, 4), dtype=np.uint8)
+        rgba[:, :, :3] = rng.integers(0, 255, 3)
+        yy, xx = np.ogrid[:h, :w]
+        rgba[:, :, 3] = np.where(((xx - w / 2) / (w / 2)) ** 2 + ((yy - h / 2) / (h / 2)) ** 2 < 1, 255, 0)
+        cutouts[obj_id] = rgba
+        paths[obj_id] = os.path.join(folder, f"cutout_{obj_id}.png")
+        Image.fromarray(rgba, 'RGBA').save(paths[obj_id])
+        scale = 800 / width
+        objects.append({
+            'id': obj_id, 'left': float(rng.uniform(0, width - w)) * scale, 'top': float(rng.uniform(0, height - h)) * scale,
+            'width': w * scale * float(rng.uniform(0.7, 1.3)), 'height': h * scale * float(rng.uniform(0.7, 1.3)),
+            'angle': float(rng.choice([0, 15, 45, 90])), 'flipX': bool(rng.integers(0, 2)),
+        })
+    return room, cutouts, paths, objects
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--counts", default="1,5,10,20,40")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--output", help="Write the report as JSON to this path.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    rows = []
+    with tempfile.TemporaryDirectory() as folder:
+        for count in [int(c) for c in args.counts.split(",") if c.strip()]:
+            room, cutouts, paths, objects = synthetic_scene(args.width, args.height, count, rng, folder)
+            pil_times, affine_times = [], []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                reference = pil_collage(room, paths, objects)
+                pil_times.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                result = build_crude_collage(room, cutouts, objects)
+                affine_times.append(time.perf_counter() - start)
+            diff = np.abs(np.asarray(reference, dtype=np.int16) - np.asarray(result, dtype=np.int16))
+            rows.append({
+                'objects': count,
+                'pil_seconds': round(statistics.median(pil_times), 4),
+                'affine_seconds': round(statistics.median(affine_times), 4),
+                # Share of clearly different pixels; only object edges should differ.
+                'pixels_differing_over_32': round(float(np.mean(diff.max(axis=2) > 32)), 5),
+            })
+
+    print(f"\nCanvas {args.width}x{args.height}")
+    print(f"{'objects':>8} {'PIL s':>8} {'affine s':>9} {'speedup':>8} {'diff px':>9}")
+    for r in rows:
+        print(f"{r['objects']:>8} {r['pil_seconds']:>8.3f} {r['affine_seconds']:>9.3f} "
+              f"{r['pil_seconds'] / r['affine_seconds']:>7.1f}x {r['pixels_differing_over_32']:>9.4f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({'canvas': [args.width, args.height], 'runs': args.runs, 'results': rows}, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Reports detection latency and mask quality for several MAX_INFERENCE_SIDE caps against uncapped inference.
+
+With --roi every cap is also measured with change-guided (ROI) detection.
+
+Usage:
+    python benchmark_resolution.py --empty empty.jpg --staged staged.jpg --caps 2048,1600,1280,1024,768 --output caps.json
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+from PIL import Image
+
+from image_processing import run_detection_and_populate_editor, gd_result_cache, sam_embedding_cache
+from models import load_models
+from session_store import new_session_state
+
+
+def mask_iou(a, b) -> float:
+    """IoU of two CompactMasks, computed over the union of their bounding boxes only."""
+    ax, ay, aw, ah = a.bbox
+    bx, by, bw, bh = b.bbox
+    x0, y0 = min(ax, bx), min(ay, by)
+    x1, y1 = max(ax + aw, bx + bw), max(ay + ah, by + bh)
+    crop_a, crop_b = a.crop(x0, y0, x1 - x0, y1 - y0), b.crop(x0, y0, x1 - x0, y1 - y0)
+    union = np.count_nonzero(crop_a | crop_b)
+    return np.count_nonzero(crop_a & crop_b) / union if union else 1.0
+
+
+def match_quality(reference: list[dict], candidate: list[dict]) -> dict:
+    """Greedy one-to-one matching of candidate masks to reference masks by IoU."""
+    unmatched = list(candidate)
+    ious = []
+    for ref in reference:
+        if not unmatched:
+            ious.append(0.0)
+            continue
+        scores = [mask_iou(ref['mask'], c['mask']) for c in unmatched]
+        best = int(np.argmax(scores))
+        ious.append(scores[best])
+        unmatched.pop(best)
+    return {
+        'mean_mask_iou': round(float(np.mean(ious)), 4) if ious else 1.0,
+        'min_mask_iou': round(float(np.min(ious)), 4) if ious else 1.0,
+        'extra_objects': len(unmatched),
+    }
+
+
+def run_once(empty_path, staged_pil, prompts, models, max_side, runs, roi=False):
+    timings, state = [], None
+    for _ in range(runs):
+        # Caches would turn every run after the first into a lookup; measure full inference each time.
+        gd_result_cache.clear()
+        sam_embedding_cache.clear()
+        state = new_session_state()
+        start = time.perf_counter()
+        run_detection_and_populate_editor(state, empty_path, staged_pil, prompts, *models, max_side=max_side, roi=roi)
+        timings.append(time.perf_counter() - start)
+    return state["staged_annotations"], float(np.median(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--empty", required=True)
+    parser.add_argument("--staged", required=True)
+    parser.add_argument("--prompts", default="furniture, object")
+    parser.add_argument("--caps", default="2048,1600,1280,1024,768")
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--roi", action="store_true", help="Also measure each cap with change-guided detection.")
+    parser.add_argument("--output", help="Write the report as JSON to this path.")
+    args = parser.parse_args()
+
+    models = load_models()
+    empty_size = Image.open(args.empty).size
+    staged_pil = Image.open(args.staged).convert("RGB").resize(empty_size)
+
+    reference, reference_seconds = run_once(args.empty, staged_pil, args.prompts, models, None, args.runs)
+    rows = [{'max_side': None, 'roi': False, 'seconds': round(reference_seconds, 3), 'objects': len(reference),
+             'mean_mask_iou': 1.0, 'min_mask_iou': 1.0, 'extra_objects': 0}]
+    for cap in [int(c) for c in args.caps.split(",") if c.strip()]:
+        for roi in ([False, True] if args.roi else [False]):
+            annotations, seconds = run_once(args.empty, staged_pil, args.prompts, models, cap, args.runs, roi=roi)
+            rows.append({'max_side': cap, 'roi': roi, 'seconds': round(seconds, 3), 'objects': len(annotations),
+                         **match_quality(reference, annotations)})
+
+    print(f"\nImage {staged_pil.width}x{staged_pil.height}")
+    print(f"{'max_side':>9} {'roi':>5} {'seconds':>8} {'speedup':>8} {'objects':>8} {'mean IoU':>9} {'min IoU':>8} {'extra':>6}")
+    for row in rows:
+        print(f"{str(row['max_side']):>9} {str(row['roi']):>5} {row['seconds']:>8.3f} {reference_seconds / row['seconds']:>7.2f}x "
+              f"{row['objects']:>8} {row['mean_mask_iou']:>9.3f} {row['min_mask_iou']:>8.3f} {row['extra_objects']:>6}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({'image_size': staged_pil.size, 'runs': args.runs, 'results': rows}, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""Times each stage of /detect and /run_ai on synthetic room pairs, offline on CPU, and writes a regression baseline.
+
+Grounding DINO and SAM are replaced by stubs that return the synthetic ground truth, so the numbers cover the
+code around the models. --random-sam swaps in a randomly initialised SAM ViT-B to include encoder cost.
+Stage memory is the growth of process RSS over the stage (so numpy/torch/OpenCV allocations count), plus the
+peak CUDA allocation when running on a GPU.
+
+Usage:
+    python benchmark_stages.py --sizes 1600x1200,4000x3000 --objects 5,20 --runs 5 --output stages.json
+    python benchmark_stages.py --compare stages.json --tolerance 0.25
+"""
+import argparse
+import json
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from asset_store import AssetStore
+from compositor import build_crude_collage
+from config import DEVICE
+from drawing import draw_contours_with_selection, get_overlay_cache, OverlayCache
+from caches import image_content_hash
+from image_processing import (changed_pixels, detect_hf_grounding_dino_raw, encode_sam_batch, segment_sam_filtered,
+                              annotations_from_geometry, remove_background_and_add_border, build_cutout_rgba,
+                              gd_result_cache, sam_embedding_cache)
+from session_store import new_session_state
+
+
+class _Inputs(dict):
+    """Mimics BatchEncoding: attribute access and `.to(device)`."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def to(self, device):
+        return self
+
+
+class StubGroundingDinoProcessor:
+    """Stands in for the Hugging Face processor; post-processing returns the scene's ground-truth boxes."""
+
+    def __init__(self, boxes: list[tuple[int, int, int, int]]):
+        self.boxes = torch.tensor(boxes, dtype=torch.float32).reshape(-1, 4)
+
+    def __call__(self, images, text, padding=True, return_tensors="pt", **kwargs):
+        pixels = torch.stack([torch.from_numpy(np.array(img.resize((1066, 800)))).permute(2, 0, 1) for img in images])
+        return _Inputs(pixel_values=pixels.float() / 255, input_ids=torch.zeros((len(images), 8), dtype=torch.long))
+
+    def post_process_grounded_object_detection(self, outputs, input_ids, threshold, text_threshold, target_sizes):
+        return [{"boxes": self.boxes.clone(), "scores": torch.full((len(self.boxes),), 0.9),
+                 "text_labels": ["furniture"] * len(self.boxes)} for _ in target_sizes]
+
+
+class StubGroundingDinoModel:
+    name_or_path = "stub-grounding-dino"
+
+    def __call__(self, **inputs):
+        return None
+
+
+class _IdentityTransform:
+    def apply_image(self, image):
+        return image
+
+    def apply_boxes_torch(self, boxes, original_size):
+        return boxes
+
+
+class _StubSamModel:
+    """The `predictor.model` parts that the batched encoder (`encode_sam_batch`) calls directly."""
+
+    def preprocess(self, image):
+        return torch.zeros((3, 64, 64))
+
+    def image_encoder(self, batch):
+        return torch.zeros((len(batch), 256, 64, 64))
+
+
+class StubSamPredictor:
+    """SamPredictor stand-in: `predict_torch` rasterises the ellipse inscribed in each box at full resolution."""
+
+    def __init__(self):
+        self.model = _StubSamModel()
+        self.transform = _IdentityTransform()
+        self.reset_image()
+
+    def reset_image(self):
+        self.features, self.original_size, self.input_size, self.is_image_set = None, None, None, False
+
+    def set_image(self, image: np.ndarray):
+        self.features = torch.zeros((1, 256, 64, 64))
+        self.original_size = self.input_size = image.shape[:2]
+        self.is_image_set = True
+
+    def predict_torch(self, point_coords, point_labels, boxes, multimask_output=False):
+        height, width = self.original_size
+        masks = np.zeros((len(boxes), 1, height, width), dtype=np.uint8)
+        for i, (x0, y0, x1, y1) in enumerate(boxes.round().int().tolist()):
+            cv2.ellipse(masks[i, 0], ((x0 + x1) // 2, (y0 + y1) // 2), ((x1 - x0) // 2, (y1 - y0) // 2), 0, 0, 360, 1, -1)
+        return torch.from_numpy(masks.astype(bool)), torch.ones((len(boxes), 1)), None
+
+
+def current_rss_bytes() -> int:
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def measure_stage_memory(fn) -> tuple[int, int | None]:
+    """Runs `fn` once; returns its peak RSS growth and, on CUDA, its peak allocated device memory, in bytes.
+
+    RSS is sampled every few milliseconds on a helper thread, so very short-lived spikes can be missed.
+    """
+    start = current_rss_bytes()
+    peak = [start]
+    finished = threading.Event()
+
+    def sample():
+        while not finished.wait(0.002):
+            peak[0] = max(peak[0], current_rss_bytes())
+
+    cuda = DEVICE.type == 'cuda'
+    if cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        cuda_baseline = torch.cuda.memory_allocated()
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        fn()
+        if cuda:
+            torch.cuda.synchronize()
+    finally:
+        finished.set()
+        sampler.join()
+    rss_growth = max(peak[0], current_rss_bytes()) - start
+    return rss_growth, (torch.cuda.max_memory_allocated() - cuda_baseline if cuda else None)
+
+
+def random_sam_predictor():
+    from segment_anything import SamPredictor, sam_model_registry
+    torch.manual_seed(0)
+    return SamPredictor(sam_model_registry["vit_b"](checkpoint=None).eval())
+
+
+def synthetic_pair(width: int, height: int, count: int, rng: np.random.Generator):
+    """An empty room (walls, floor, sensor noise) and the same room with `count` textured elliptical objects."""
+    empty = np.empty((height, width, 3), dtype=np.uint8)
+    empty[:int(height * 0.6)] = (205, 200, 190)
+    empty[int(height * 0.6):] = (150, 120, 90)
+    empty = np.clip(empty.astype(np.int16) + rng.integers(-6, 7, empty.shape), 0, 255).astype(np.uint8)
+
+    staged, boxes = empty.copy(), []
+    for _ in range(count):
+        w, h = int(rng.integers(width // 16, width // 6)), int(rng.integers(height // 16, height // 6))
+        x, y = int(rng.integers(0, width - w)), int(rng.integers(int(height * 0.3), height - h))
+        color = rng.integers(0, 255, 3)
+        patch = np.clip(color + rng.integers(-20, 21, (h, w, 3)), 0, 255).astype(np.uint8)
+        inside = np.zeros((h, w), dtype=np.uint8)
+        cv2.ellipse(inside, (w // 2, h // 2), (w // 2, h // 2), 0, 0, 360, 1, -1)
+        region = staged[y:y + h, x:x + w]
+        region[inside.astype(bool)] = patch[inside.astype(bool)]
+        boxes.append((x, y, x + w, y + h))
+    return Image.fromarray(empty), Image.fromarray(staged), boxes
+
+
+def collage_objects(annotations: list[dict], width: int, rng: np.random.Generator) -> list[dict]:
+    scale = 800 / width
+    return [{'id': a['id'], 'left': a['bbox'][0] * scale, 'top': a['bbox'][1] * scale,
+             'width': a['bbox'][2] * scale, 'height': a['bbox'][3] * scale,
+             'angle': float(rng.choice([0, 10, 30])), 'flipX': bool(rng.integers(0, 2))} for a in annotations]
+
+
+def run_scenario(width: int, height: int, count: int, runs: int, sam_predictor, assets: AssetStore, rng) -> dict:
+    empty_pil, staged_pil, boxes = synthetic_pair(width, height, count, rng)
+    empty_np, staged_np = np.array(empty_pil), np.array(staged_pil)
+    processor, model = StubGroundingDinoProcessor(boxes), StubGroundingDinoModel()
+
+    # Stages run in pipeline order; each reads the previous stage's output from `context`.
+    context = {}
+
+    def diff():
+        context['changed'] = changed_pixels(empty_np, staged_np)
+
+    def detect():
+        gd_result_cache.clear()
+        context['gd'] = detect_hf_grounding_dino_raw(staged_pil, "furniture.", processor, model)
+
+    def segment():
+        # As in segment_prepared_inputs: batched encode, then the chunked decode, which also filters the masks.
+        sam_embedding_cache.clear()
+        staged_key = image_content_hash(staged_np)
+        encode_sam_batch(sam_predictor, [staged_np], [staged_key])
+        context['geometry'] = segment_sam_filtered(staged_np, sam_predictor, context['gd']['boxes'], context['changed'],
+                                                   image_key=staged_key)
+
+    def postprocess():
+        context['state'] = new_session_state()
+        context['state'].update({"staged_image": staged_pil, "empty_image": empty_pil})
+        context['annotations'] = annotations_from_geometry(context['state'], context['geometry'])
+        context['state']['staged_annotations'] = context['annotations']
+
+    def background():
+        remove_background_and_add_border(context['state'])
+
+    def cutouts():
+        context['cutouts'] = {a['id']: build_cutout_rgba(staged_np, a) for a in context['annotations']}
+        for cutout in context['cutouts'].values():
+            assets.put_image(Image.fromarray(cutout, 'RGBA'), "cutout")
+
+    def collage():
+        objects = collage_objects(context['annotations'], width, np.random.default_rng(1))
+        build_crude_collage(empty_pil, context['cutouts'], objects)
+
+    def overlay_cold():
+        OverlayCache(staged_pil).render(context['annotations'])
+
+    def overlay_select():
+        ids = [a['id'] for a in context['annotations']] or [None]
+        draw_contours_with_selection(staged_pil, context['annotations'], ids[len(ids) // 2],
+                                     get_overlay_cache(context['state'], "staged"))
+
+    stages = [("diff_dilate", diff), ("grounding_dino", detect), ("segment_sam", segment),
+              ("mask_postprocess", postprocess), ("remove_background", background), ("cutout_write", cutouts),
+              ("collage_composite", collage), ("overlay_full_render", overlay_cold), ("overlay_selection", overlay_select)]
+
+    results = {}
+    for name, fn in stages:
+        fn()  # warm-up, and produces the input of the next stage
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+        rss_growth, cuda_peak = measure_stage_memory(fn)
+        results[name] = {
+            'p50': round(float(np.percentile(timings, 50)), 5),
+            'p90': round(float(np.percentile(timings, 90)), 5),
+            'p99': round(float(np.percentile(timings, 99)), 5),
+            'rss_peak_mib': round(rss_growth / 1024 ** 2, 2),
+        }
+        if cuda_peak is not None:
+            results[name]['cuda_peak_mib'] = round(cuda_peak / 1024 ** 2, 2)
+    return {'size': [width, height], 'objects': count, 'detected': len(context['annotations']), 'stages': results}
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Stages whose p50 grew by more than `tolerance` (relative) against the matching baseline scenario."""
+    regressions = []
+    base_scenarios = {(tuple(s['size']), s['objects']): s for s in baseline['scenarios']}
+    for scenario in report['scenarios']:
+        base = base_scenarios.get((tuple(scenario['size']), scenario['objects']))
+        if base is None:
+            continue
+        for name, stats in scenario['stages'].items():
+            base_p50 = base['stages'].get(name, {}).get('p50')
+            # Sub-millisecond stages are dominated by timer noise.
+            if base_p50 and stats['p50'] > 0.001 and stats['p50'] > base_p50 * (1 + tolerance):
+                regressions.append(f"{scenario['size'][0]}x{scenario['size'][1]} / {scenario['objects']} objects / {name}: "
+                                   f"{base_p50 * 1000:.1f} ms -> {stats['p50'] * 1000:.1f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1600x1200,4000x3000")
+    parser.add_argument("--objects", default="5,20")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--random-sam", action="store_true", help="Use a randomly initialised SAM ViT-B instead of the stub.")
+    parser.add_argument("--output", help="Write the report as JSON to this path (use it as a baseline later).")
+    parser.add_argument("--compare", help="Baseline JSON to compare against; exits with status 1 on regressions.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative p50 slowdown per stage.")
+    args = parser.parse_args()
+
+    sam_predictor = random_sam_predictor() if args.random_sam else StubSamPredictor()
+    sizes = [tuple(int(v) for v in s.lower().split("x")) for s in args.sizes.split(",") if s.strip()]
+    counts = [int(c) for c in args.objects.split(",") if c.strip()]
+    rng = np.random.default_rng(0)
+
+    scenarios = []
+    with tempfile.TemporaryDirectory() as folder:
+        assets = AssetStore(folder, "/uploads")
+        for width, height in sizes:
+            for count in counts:
+                print(f"--- {width}x{height}, {count} objects ---")
+                scenarios.append(run_scenario(width, height, count, args.runs, sam_predictor, assets, rng))
+
+    report = {
+        'environment': {'python': platform.python_version(), 'torch': torch.__version__, 'opencv': cv2.__version__,
+                        'machine': platform.machine(), 'threads': torch.get_num_threads()},
+        'sam': 'random-vit_b' if args.random_sam else 'stub', 'runs': args.runs,
+        'process_peak_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'scenarios': scenarios,
+    }
+
+    for scenario in scenarios:
+        print(f"\n{scenario['size'][0]}x{scenario['size'][1]}, {scenario['objects']} objects ({scenario['detected']} kept)")
+        print(f"{'stage':<20} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'RSS MiB':>9} {'CUDA MiB':>9}")
+        for name, stats in scenario['stages'].items():
+            cuda_peak = f"{stats['cuda_peak_mib']:>9.1f}" if 'cuda_peak_mib' in stats else f"{'-':>9}"
+            print(f"{name:<20} {stats['p50'] * 1000:>9.2f} {stats['p90'] * 1000:>9.2f} {stats['p99'] * 1000:>9.2f} "
+                  f"{stats['rss_peak_mib']:>9.1f} {cuda_peak}")
+    print(f"\nProcess peak RSS: {report['process_peak_rss_mib']} MiB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Callable
+
+import numpy as np
+from PIL import Image
+
+
+def image_content_hash(image: Image.Image | np.ndarray) -> str:
+    """Hashes decoded pixel content (plus shape/dtype) so identical images map to the same key regardless of file name.
+
+    A PIL image and `np.array` of it hash identically, so stages holding either form can share cache keys.
+    """
+    array = np.ascontiguousarray(np.asarray(image))
+    digest = hashlib.blake2b(f"{array.dtype}:{array.shape}".encode(), digest_size=16)
+    digest.update(array.data)
+    return digest.hexdigest()
+
+
+def tensor_nbytes(value) -> int:
+    """Size in bytes of a tensor/array/string, or of a tuple/list/dict of them."""
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value)
+    if hasattr(value, "element_size") and hasattr(value, "nelement"):
+        return value.element_size() * value.nelement()
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sum(tensor_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(tensor_nbytes(v) for v in value)
+    return 0
+
+
+class ByteLRUCache:
+    """Thread-safe LRU cache bounded by the total byte size of its values, with hit/miss counters."""
+
+    def __init__(self, max_bytes: int, sizeof: Callable[[object], int] = tensor_nbytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[object, int]] = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, value) -> None:
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self._total_bytes}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries
+
+
+class DiskLRUCache:
+    """Key -> bytes cache kept as files in `folder`, bounded by total size; reads refresh mtime, writes evict the oldest."""
+
+    def __init__(self, folder: str, max_bytes: int, suffix: str = ""):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, f"{key}{self.suffix}")
+
+    def get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        tmp_path = os.path.join(self.folder, f".tmp_{uuid.uuid4().hex}")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        with self._lock:
+            os.replace(tmp_path, self._path(key))
+            self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.startswith(".tmp_"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
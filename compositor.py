@@ -0,0 +1,79 @@
+import math
+import cv2
+import numpy as np
+from PIL import Image
+
+
+def placement_matrix(cutout_w: int, cutout_h: int, left: float, top: float, width: int, height: int,
+                     angle_deg: float = 0, flip_x: bool = False) -> np.ndarray:
+    """2x3 affine map from cutout pixels to canvas pixels: scale to (width, height), optional flip, clockwise rotation.
+
+    Matches the editor's placement: the object is scaled into the box at (left, top), then rotated about
+    the box centre, so the rotated piece stays centred where the unrotated box was.
+    """
+    sx, sy = width / cutout_w, height / cutout_h
+    if flip_x:
+        scale_flip = np.array([[-sx, 0, width], [0, sy, 0], [0, 0, 1]], dtype=np.float64)
+    else:
+        scale_flip = np.array([[sx, 0, 0], [0, sy, 0], [0, 0, 1]], dtype=np.float64)
+
+    # With y pointing down this standard rotation turns clockwise on screen, like fabric.js angles.
+    theta = math.radians(angle_deg)
+    cos, sin = math.cos(theta), math.sin(theta)
+    cx, cy = width / 2, height / 2
+    rotate = np.array([[cos, -sin, cx - cx * cos + cy * sin],
+                       [sin, cos, cy - cx * sin - cy * cos],
+                       [0, 0, 1]], dtype=np.float64)
+    translate = np.array([[1, 0, left], [0, 1, top], [0, 0, 1]], dtype=np.float64)
+    return (translate @ rotate @ scale_flip)[:2]
+
+
+def composite_piece(canvas: np.ndarray, piece_rgba: np.ndarray, matrix: np.ndarray) -> None:
+    """Warps an RGBA piece into only its destination ROI of an RGB uint8 canvas and alpha-blends it in place."""
+    h, w = piece_rgba.shape[:2]
+    corners = np.array([[0, 0, 1], [w, 0, 1], [0, h, 1], [w, h, 1]], dtype=np.float64) @ matrix.T
+    x0, y0 = np.floor(corners.min(axis=0)).astype(int)
+    x1, y1 = np.ceil(corners.max(axis=0)).astype(int)
+    x0, y0 = max(x0, 0), max(y0, 0)
+    x1, y1 = min(x1, canvas.shape[1]), min(y1, canvas.shape[0])
+    if x0 >= x1 or y0 >= y1:
+        return
+
+    roi_matrix = matrix.copy()
+    roi_matrix[:, 2] -= (x0, y0)
+    # One bilinear resample replaces the previous resize + rotate pair.
+    warped = cv2.warpAffine(piece_rgba, roi_matrix, (x1 - x0, y1 - y0), flags=cv2.INTER_LINEAR,
+                            borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0, 0))
+
+    alpha = warped[:, :, 3].astype(np.float32) * (1 / 255)
+    roi = canvas[y0:y1, x0:x1]
+    roi[...] = cv2.blendLinear(np.ascontiguousarray(warped[:, :, :3]), np.ascontiguousarray(roi), alpha, 1 - alpha)
+
+
+def build_crude_collage(empty_room_img: Image.Image, cutouts_by_id: dict, final_objects: list[dict],
+                        canvas_width: int = 800) -> Image.Image:
+    """Places decoded RGBA cutouts onto the empty room following the editor's object list (last is on top)."""
+    canvas = np.array(empty_room_img if empty_room_img.mode == "RGB" else empty_room_img.convert("RGB"))
+    scale_factor = empty_room_img.width / canvas_width
+
+    for obj_data in final_objects:
+        obj_id = obj_data.get('id')
+        if obj_id is None: continue
+
+        piece = cutouts_by_id.get(obj_id)
+        if piece is None: continue
+
+        unscaled_left = int(obj_data['left'] * scale_factor)
+        unscaled_top = int(obj_data['top'] * scale_factor)
+        unscaled_width = int(obj_data['width'] * scale_factor)
+        unscaled_height = int(obj_data['height'] * scale_factor)
+
+        if unscaled_width <= 0 or unscaled_height <= 0: continue
+
+        matrix = placement_matrix(
+            piece.shape[1], piece.shape[0], unscaled_left, unscaled_top, unscaled_width, unscaled_height,
+            obj_data.get('angle', 0), obj_data.get('flipX', False)
+        )
+        composite_piece(canvas, piece, matrix)
+
+    return Image.fromarray(canvas)
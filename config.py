@@ -1,9 +1,60 @@
+import os
 import torch
 
 DEVICE: torch.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
-HF_GD_MODEL_ID: str = "IDEA-Research/grounding-dino-tiny"
-SAM_CHECKPOINT_PATH: str = 'sam_vit_h_4b8939.pth'
+# Model tiers. Smaller variants trade accuracy for latency on CPU-only nodes; override per deployment via env.
+GD_MODEL_IDS: dict[str, str] = {
+    "tiny": "IDEA-Research/grounding-dino-tiny",
+    "base": "IDEA-Research/grounding-dino-base",
+}
+GD_MODEL_VARIANT: str = os.environ.get("GD_MODEL_VARIANT", "tiny")
+# A Hugging Face repo id (resolved from the local HF cache) or a local directory with the saved model.
+HF_GD_MODEL_ID: str = os.environ.get("GD_MODEL_PATH", GD_MODEL_IDS[GD_MODEL_VARIANT])
+GD_BOX_THRESHOLD: float = 0.25
+GD_TEXT_THRESHOLD: float = 0.25
+# Longest side of the copy that diffing, detection and segmentation run on; masks are mapped back to full resolution.
+# None disables the cap. Grounding DINO and SAM resize internally anyway, so quality barely changes above ~1600px.
+MAX_INFERENCE_SIDE: int | None = 1600
+# Images per forward pass when several rooms are detected together (/detect_batch).
+GD_BATCH_SIZE: int = 4
+# ViT global attention is memory-heavy; on CPU one image per encoder pass already saturates the cores.
+SAM_ENCODER_BATCH_SIZE: int = 4 if DEVICE.type == 'cuda' else 1
+# Mask decoding upsamples every box to a float32 frame at once; boxes are decoded in chunks sized to keep those
+# buffers under this budget, and each chunk is filtered and compacted before the next one is decoded.
+SAM_DECODE_MEMORY_BUDGET_BYTES: int = int(os.environ.get("SAM_DECODE_MEMORY_BUDGET_BYTES", 256 * 1024 ** 2))
+# Change-guided detection: Grounding DINO only sees padded crops around the connected regions of the
+# empty/staged diff. Falls back to the full frame when the crops would cover most of the image anyway.
+ROI_DETECTION: bool = os.environ.get("ROI_DETECTION", "0") == "1"
+ROI_MAX_REGIONS: int = 4
+ROI_PADDING_RATIO: float = 0.15
+ROI_MIN_PADDING: int = 24
+# Changed components smaller than this share of the frame are treated as diff noise.
+ROI_MIN_REGION_AREA_RATIO: float = 0.0005
+ROI_MAX_COVERAGE: float = 0.6
+# Crops are mostly object, so they are not upscaled to the detector's full 800px input.
+ROI_GD_SIZE: dict[str, int] = {"shortest_edge": 512, "longest_edge": 853}
+
+SAM_CHECKPOINT_FILES: dict[str, str] = {
+    "vit_b": "sam_vit_b_01ec64.pth",
+    "vit_l": "sam_vit_l_0b3195.pth",
+    "vit_h": "sam_vit_h_4b8939.pth",
+}
+SAM_MODEL_TYPE: str = os.environ.get("SAM_MODEL_TYPE", "vit_h")
+SAM_CHECKPOINT_PATH: str = os.environ.get("SAM_CHECKPOINT_PATH", SAM_CHECKPOINT_FILES[SAM_MODEL_TYPE])
+
+# Weights are only ever read from disk; nothing is downloaded at startup.
+MODELS_LOCAL_FILES_ONLY: bool = True
+
+# CPU inference backend: "eager" (fp32 PyTorch), "quantized" (dynamic int8 Linear layers),
+# "compiled" (torch.compile) or "onnx" (SAM image encoder exported to ONNX Runtime).
+INFERENCE_BACKEND: str = os.environ.get("INFERENCE_BACKEND", "eager")
+ONNX_EXPORT_DIR: str = "onnx_models"
+# When set, a non-eager backend is only kept if it matches eager output on this image within the IoU tolerances.
+PARITY_PROBE_IMAGE: str | None = os.environ.get("PARITY_PROBE_IMAGE")
+PARITY_PROBE_PROMPT: str = "furniture. object."
+PARITY_MIN_BOX_IOU: float = 0.9
+PARITY_MIN_MASK_IOU: float = 0.85
 
 GENAI_AVAILABLE = False
 try:
@@ -12,6 +63,35 @@ try:
 except ImportError:
     print("WARNING: google-generativeai not found. The 'Enhanced AI Edit' feature will be disabled.")
 
+# Gemini client: one long-lived client shared by all /run_ai jobs, with bounded concurrency, per-attempt
+# timeouts and retries with jittered exponential backoff on transient errors (rate limits, 5xx, timeouts).
+GEMINI_MODEL_NAME: str = os.environ.get("GEMINI_MODEL_NAME", "gemini-2.5-flash-image-preview")
+# When set, requests go over plain HTTP to this Generative Language API-compatible endpoint (e.g. a local stub).
+GEMINI_API_BASE_URL: str | None = os.environ.get("GEMINI_API_BASE_URL")
+GEMINI_MAX_CONCURRENCY: int = int(os.environ.get("GEMINI_MAX_CONCURRENCY", 4))
+GEMINI_TIMEOUT_SECONDS: float = 120.0
+GEMINI_DEADLINE_SECONDS: float = 300.0
+GEMINI_MAX_RETRIES: int = 3
+GEMINI_BACKOFF_BASE_SECONDS: float = 1.0
+GEMINI_BACKOFF_MAX_SECONDS: float = 20.0
+# The collage sent to Gemini is capped at this side length and encoded (quality-searched) to fit the byte budget;
+# the result is resized back to the room photo's dimensions.
+AI_PAYLOAD_MAX_SIDE: int = int(os.environ.get("AI_PAYLOAD_MAX_SIDE", 1536))
+AI_PAYLOAD_MAX_BYTES: int = int(os.environ.get("AI_PAYLOAD_MAX_BYTES", 2 * 1024 ** 2))
+AI_PAYLOAD_FORMAT: str = os.environ.get("AI_PAYLOAD_FORMAT", "JPEG")  # "JPEG" or "WEBP"
+AI_PAYLOAD_MIN_QUALITY: int = 60
+AI_PAYLOAD_MAX_QUALITY: int = 95
+# Finished AI edits on disk, keyed by collage pixels + final prompt; repeated identical requests skip Gemini.
+AI_EDIT_CACHE_DIR: str = "ai_edit_cache"
+AI_EDIT_CACHE_BYTES: int = int(os.environ.get("AI_EDIT_CACHE_BYTES", 1024 ** 3))
+
+ONNXRUNTIME_AVAILABLE = False
+try:
+    import onnxruntime
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    pass
+
 NAMED_COLORS: dict[str, dict[str, object]] = {
     "red": {"rgb": [255, 0, 0], "hex": "#FF0000"},
     "blue": {"rgb": [0, 0, 255], "hex": "#0000FF"},
@@ -25,15 +105,51 @@ NAMED_COLORS: dict[str, dict[str, object]] = {
     "white": {"rgb": [255, 255, 255], "hex": "#FFFFFF"},
 }
 
-detection_results: dict[str, object] = {
-    "staged_annotations": [],
-    "empty_annotations": [],
-    "staged_image": None,
-    "empty_image": None,
-    "staged_image_bg_removed": None, 
-    "selected_staged": None,
-    "selected_empty": None,
-    "next_id": 1,
-    "generated_images": [],
-    "original_cutouts_by_id": {} 
-}
\ No newline at end of file
+# Per-session editor state (images, masks, cutouts) is kept in memory and evicted LRU-first past these limits.
+SESSION_MEMORY_BUDGET_BYTES: int = 2 * 1024 ** 3
+SESSION_MAX_COUNT: int = 64
+# Most image pairs one /detect_batch request may submit; kept well below SESSION_MAX_COUNT so a batch never
+# evicts its own earlier sessions before the client can open them.
+DETECT_BATCH_MAX_PAIRS: int = 16
+# Upload size limits. A request carrying one empty/staged pair may be up to two images' worth; /detect_batch
+# gets that allowance once per pair it is allowed to send.
+UPLOAD_MAX_IMAGE_BYTES: int = 8 * 1024 ** 2
+REQUEST_MAX_BYTES: int = 2 * UPLOAD_MAX_IMAGE_BYTES
+DETECT_BATCH_MAX_BYTES: int = DETECT_BATCH_MAX_PAIRS * REQUEST_MAX_BYTES
+
+# Upper bound on cached SAM image embeddings (a vit_h embedding is ~4 MB).
+SAM_EMBEDDING_CACHE_BYTES: int = 512 * 1024 ** 2
+
+# Upper bound on memoized Grounding DINO results (boxes/scores/labels per image + prompt set).
+GD_RESULT_CACHE_BYTES: int = 16 * 1024 ** 2
+
+# Job scheduling: model inference is serialized on one worker, remote AI edits run on a small pool.
+INFERENCE_QUEUE_MAX_DEPTH: int = 16
+NETWORK_JOB_MAX_CONCURRENCY: int = 4
+NETWORK_QUEUE_MAX_DEPTH: int = 32
+JOB_RESULT_TTL_SECONDS: int = 60 * 60
+# /refine_mask waits this long for the inference worker, then gives up with 503 rather than holding the thread.
+REFINE_WAIT_TIMEOUT_SECONDS: float = 30.0
+# Shared model server (model_server.py). With MODEL_SERVER_ADDRESS set, web workers send Grounding DINO and SAM
+# work to that Unix socket instead of loading their own copy of the models.
+MODEL_SERVER_ADDRESS: str | None = os.environ.get("MODEL_SERVER_ADDRESS") or None
+# Shared secret for the model server socket, required on both ends: the server unpickles what it receives, so
+# the key is the only thing keeping other local users from running code in it. There is deliberately no default.
+MODEL_SERVER_AUTHKEY: bytes = os.environ.get("MODEL_SERVER_AUTHKEY", "").encode()
+# Detection requests arriving within this window are merged into one batched pass (up to GD_BATCH_SIZE pairs).
+MODEL_SERVER_BATCH_WAIT_SECONDS: float = float(os.environ.get("MODEL_SERVER_BATCH_WAIT_SECONDS", "0.02"))
+# Idle /jobs/<id>/events streams send a comment line this often so proxies keep the connection open.
+JOB_EVENTS_KEEPALIVE_SECONDS: float = 15.0
+
+# Files under uploads/ are content-addressed; idle ones expire and the folder is trimmed LRU-first past the budget.
+ASSET_STORE_MAX_BYTES: int = int(os.environ.get("ASSET_STORE_MAX_BYTES", 5 * 1024 ** 3))
+ASSET_TTL_SECONDS: int = int(os.environ.get("ASSET_TTL_SECONDS", 24 * 60 * 60))
+ASSET_SWEEP_INTERVAL_SECONDS: int = 10 * 60
+
+# Grid cell size (pixels) of the per-image spatial index used for click hit-testing.
+ANNOTATION_GRID_CELL_SIZE: int = 64
+
+# Observability: stage timings and counters are served at /metrics (Prometheus text format);
+# TRACE_JSON_LOGS=1 also prints one JSON line per stage span and per request.
+TRACE_JSON_LOGS: bool = os.environ.get("TRACE_JSON_LOGS", "0") == "1"
+STAGE_LATENCY_BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
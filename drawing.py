@@ -1,3 +1,6 @@
+import threading
+from functools import lru_cache
+
 import cv2
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
@@ -11,56 +14,220 @@ def get_color_name_from_rgb(rgb_color: list[int]) -> str:
             min_distance, closest_color = dist, name
     return closest_color
 
-def draw_contours_with_selection(image_pil: Image.Image, annotations: list[dict], selected_id: int = None) -> Image.Image | None:
-    if image_pil is None: return None
-    if not annotations: return image_pil.copy()
-    
-    image_cv = cv2.cvtColor(np.array(image_pil), cv2.COLOR_RGB2BGR)
+CONTOUR_THICKNESS = 3
+SELECTED_THICKNESS = 5
+HIGHLIGHT_COLOR = (255, 255, 0)
+FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+# Past this many changed annotations a full base rebuild is cheaper than patching regions.
+MAX_DIRTY_REGIONS = 8
 
-    for annot in annotations:
-        contour = annot.get('contour')
-        if contour is None: continue
-
-        rgb_color = annot.get('color', [255, 0, 0])
-        bgr_color = tuple(rgb_color[::-1]) 
-        obj_id = annot.get('id', 0)
-        is_selected = (obj_id == selected_id)
-        
-        thickness = 5 if is_selected else 3
-        cv2.drawContours(image_cv, [contour], -1, bgr_color, thickness)
-        
-        if is_selected:
-            cv2.drawContours(image_cv, [contour], -1, (0, 255, 255), thickness + 4,-1)
-            cv2.drawContours(image_cv, [contour], -1, bgr_color, thickness)
-
-
-    image_pil_with_contours = Image.fromarray(cv2.cvtColor(image_cv, cv2.COLOR_BGR2RGB))
-    draw = ImageDraw.Draw(image_pil_with_contours)
-    
+
+@lru_cache(maxsize=None)
+def get_font(size: int = 16) -> ImageFont.ImageFont:
     try:
-        font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 16)
+        return ImageFont.truetype(FONT_PATH, size)
     except IOError:
-        font = ImageFont.load_default()
+        return ImageFont.load_default()
 
-    for annot in annotations:
-        x, y, w, h = annot['bbox']
-        color_name = annot.get('color_name', 'unknown')
-        obj_id = annot.get('id', 0)
-        is_selected = (obj_id == selected_id)
-        
-        label_text = f"ID: {obj_id} ({color_name})"
-        label_bbox = draw.textbbox((0,0), label_text, font=font)
-        label_w, label_h = label_bbox[2] - label_bbox[0], label_bbox[3] - label_bbox[1]
-        
-        label_x, label_y = x, (y - label_h - 10 if y > label_h + 10 else y + h + 10)
-        
-        bg_color = (255, 255, 100) if is_selected else "white"
-        text_color = "darkblue" if is_selected else "black"
-        
-        draw.rectangle([label_x, label_y, label_x + label_w + 10, label_y + label_h + 10], fill=bg_color, outline=tuple(annot['color']), width=2)
-        draw.text((label_x + 5, label_y + 5), label_text, fill=text_color, font=font)
-        
-    return image_pil_with_contours
+
+@lru_cache(maxsize=1024)
+def render_label(obj_id: int, color_name: str, outline: tuple[int, ...], is_selected: bool) -> np.ndarray:
+    """Renders one opaque label box (background, outline, text) as an RGB sprite."""
+    font = get_font()
+    label_text = f"ID: {obj_id} ({color_name})"
+    label_bbox = ImageDraw.Draw(Image.new("RGB", (1, 1))).textbbox((0, 0), label_text, font=font)
+    label_w, label_h = label_bbox[2] - label_bbox[0], label_bbox[3] - label_bbox[1]
+
+    bg_color = (255, 255, 100) if is_selected else "white"
+    text_color = "darkblue" if is_selected else "black"
+    sprite = Image.new("RGB", (label_w + 11, label_h + 11), bg_color)
+    draw = ImageDraw.Draw(sprite)
+    draw.rectangle([0, 0, label_w + 10, label_h + 10], fill=bg_color, outline=outline, width=2)
+    draw.text((5, 5), label_text, fill=text_color, font=font)
+    return np.array(sprite)
+
+
+def _label_sprite(annot: dict, is_selected: bool) -> tuple[np.ndarray, int, int]:
+    sprite = render_label(annot.get('id', 0), annot.get('color_name', 'unknown'), tuple(annot['color']), is_selected)
+    x, y, w, h = annot['bbox']
+    # Same placement rule as before: above the box when there is room, otherwise below it.
+    label_h = sprite.shape[0] - 11
+    return sprite, x, (y - label_h - 10 if y > label_h + 10 else y + h + 10)
+
+
+def _intersect(a: tuple[int, int, int, int], b: tuple[int, int, int, int]) -> tuple[int, int, int, int] | None:
+    x0, y0, x1, y1 = max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3])
+    return (x0, y0, x1, y1) if x0 < x1 and y0 < y1 else None
+
+
+def _contour_extent(contour: np.ndarray | None, thickness: int) -> tuple[int, int, int, int] | None:
+    if contour is None or len(contour) == 0:
+        return None
+    x, y, w, h = cv2.boundingRect(contour)
+    pad = thickness // 2 + 2
+    return (x - pad, y - pad, x + w + pad, y + h + pad)
+
+
+def _paste(canvas: np.ndarray, sprite: np.ndarray, x: int, y: int, clip: tuple[int, int, int, int]) -> None:
+    region = _intersect((x, y, x + sprite.shape[1], y + sprite.shape[0]), clip)
+    if region is None:
+        return
+    x0, y0, x1, y1 = region
+    canvas[y0:y1, x0:x1] = sprite[y0 - y:y1 - y, x0 - x:x1 - x]
+
+
+class _AnnotationLayer:
+    """What one annotation contributes to the base layer, and the canvas area it covers."""
+
+    __slots__ = ("id", "annot", "contour", "color", "contour_extent", "sprite", "label_x", "label_y", "label_extent")
+
+    def __init__(self, annot: dict):
+        self.id = annot.get('id', 0)
+        self.annot = annot
+        contour = annot.get('contour')
+        self.contour = contour
+        self.color = tuple(int(c) for c in annot.get('color', [255, 0, 0]))
+        self.contour_extent = _contour_extent(contour, CONTOUR_THICKNESS)
+        self.sprite, self.label_x, self.label_y = _label_sprite(annot, False)
+        self.label_extent = (self.label_x, self.label_y,
+                             self.label_x + self.sprite.shape[1], self.label_y + self.sprite.shape[0])
+
+    def extents(self) -> list[tuple[int, int, int, int]]:
+        return [e for e in (self.contour_extent, self.label_extent) if e is not None]
+
+
+class OverlayCache:
+    """Cached contour/label overlay for one source image.
+
+    The base layer holds every contour and label in their unselected style. When annotations change, only the
+    regions they covered before and after are restored from the source and redrawn, clipped to those regions.
+    Selection styling is drawn on a copy of the base, so selecting costs the same regardless of object count.
+    Added, removed and replaced annotations are picked up by identity; in-place edits of an annotation's
+    geometry or colour must be reported through `mark_dirty`.
+    """
+
+    def __init__(self, image_pil: Image.Image):
+        self.image = image_pil
+        self.source = np.array(image_pil if image_pil.mode == "RGB" else image_pil.convert("RGB"))
+        self.base = self.source.copy()
+        self.annotations: list[dict] | None = None
+        self.layers: list[_AnnotationLayer] = []
+        self.dirty: set[int] = set()
+        self.full_extent = (0, 0, self.source.shape[1], self.source.shape[0])
+        self.lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        return self.source.nbytes + self.base.nbytes
+
+    def mark_dirty(self, obj_id: int) -> None:
+        with self.lock:
+            self.dirty.add(obj_id)
+
+    def update(self, annotations: list[dict]) -> None:
+        if annotations is self.annotations and len(annotations) == len(self.layers) and not self.dirty:
+            return
+
+        old_ids = [layer.id for layer in self.layers]
+        new_ids = [a.get('id', 0) for a in annotations]
+        old_by_id = {layer.id: layer for layer in self.layers}
+        layers = []
+        for annot, obj_id in zip(annotations, new_ids):
+            layer = old_by_id.get(obj_id)
+            if layer is None or layer.annot is not annot or obj_id in self.dirty:
+                layer = _AnnotationLayer(annot)
+            layers.append(layer)
+
+        dirty = []
+        if [i for i in old_ids if i in new_ids] == [i for i in new_ids if i in old_ids]:
+            kept = set(map(id, layers))
+            for layer in self.layers:
+                if id(layer) not in kept:
+                    dirty.extend(layer.extents())
+            kept_old = set(map(id, self.layers))
+            for layer in layers:
+                if id(layer) not in kept_old:
+                    dirty.extend(layer.extents())
+        else:
+            # Reordering changes which object draws on top; redraw everything.
+            dirty = [self.full_extent]
+
+        self.annotations, self.layers = annotations, layers
+        self.dirty.clear()
+        if len(dirty) > MAX_DIRTY_REGIONS:
+            dirty = [self.full_extent]
+        for region in dirty:
+            self._redraw(region)
+
+    def _redraw(self, region: tuple[int, int, int, int]) -> None:
+        clip = _intersect(region, self.full_extent)
+        if clip is None:
+            return
+        x0, y0, x1, y1 = clip
+        self.base[y0:y1, x0:x1] = self.source[y0:y1, x0:x1]
+        view = self.base[y0:y1, x0:x1]
+        # Contours first, then labels on top, as in a full render.
+        for layer in self.layers:
+            if layer.contour_extent is not None and _intersect(layer.contour_extent, clip):
+                cv2.drawContours(view, [layer.contour], -1, layer.color, CONTOUR_THICKNESS, offset=(-x0, -y0))
+        for layer in self.layers:
+            if _intersect(layer.label_extent, clip):
+                _paste(self.base, layer.sprite, layer.label_x, layer.label_y, clip)
+
+    def render(self, annotations: list[dict], selected_id: int | None = None) -> Image.Image:
+        self.update(annotations)
+        selected = next((a for a in annotations if a.get('id', 0) == selected_id), None) if selected_id is not None else None
+        if selected is None:
+            return Image.fromarray(self.base)
+
+        canvas = self.base.copy()
+        contour = selected.get('contour')
+        color = tuple(int(c) for c in selected.get('color', [255, 0, 0]))
+        highlight = _contour_extent(contour, SELECTED_THICKNESS + 4)
+        if highlight is not None:
+            cv2.drawContours(canvas, [contour], -1, HIGHLIGHT_COLOR, SELECTED_THICKNESS + 4)
+            cv2.drawContours(canvas, [contour], -1, color, SELECTED_THICKNESS)
+            # Keep labels above contours: re-paste the ones the highlight ran over.
+            for layer in self.layers:
+                if layer.id != selected_id and _intersect(layer.label_extent, highlight):
+                    _paste(canvas, layer.sprite, layer.label_x, layer.label_y, highlight)
+        sprite, label_x, label_y = _label_sprite(selected, True)
+        _paste(canvas, sprite, label_x, label_y, self.full_extent)
+        return Image.fromarray(canvas)
+
+
+def get_overlay_cache(state: dict, image_type: str) -> OverlayCache | None:
+    """Returns the overlay cache of `state[f"{image_type}_image"]`, rebuilding it only when that image was replaced.
+
+    It lives in the session state, so the session store counts its pixel copies and eviction frees them. Only the
+    interactive editor handlers create one; one-off renders (detection results) use a throwaway cache instead.
+    """
+    image = state.get(f"{image_type}_image")
+    if image is None:
+        return None
+    cache = state.get(f"{image_type}_overlay")
+    if cache is None or cache.image is not image:
+        cache = OverlayCache(image)
+        state[f"{image_type}_overlay"] = cache
+    return cache
+
+
+def mark_overlay_dirty(state: dict, image_type: str, obj_id: int) -> None:
+    """Reports an in-place edit of one annotation's geometry or colour to its overlay cache, if one exists."""
+    cache = state.get(f"{image_type}_overlay")
+    if cache is not None:
+        cache.mark_dirty(obj_id)
+
+
+def draw_contours_with_selection(image_pil: Image.Image, annotations: list[dict], selected_id: int = None,
+                                 overlay: OverlayCache | None = None) -> Image.Image | None:
+    """Renders contours and labels over `image_pil`, through `overlay` (see `get_overlay_cache`) when given."""
+    if image_pil is None: return None
+    if not annotations: return image_pil.copy()
+
+    cache = overlay if overlay is not None and overlay.image is image_pil else OverlayCache(image_pil)
+    with cache.lock:
+        return cache.render(annotations, selected_id)
 
 def draw_circles_on_image(image_pil: Image.Image, annotations: list[dict], radius: int = 25) -> Image.Image:
     if not image_pil or not annotations: return image_pil
@@ -1,20 +1,200 @@
+import asyncio
+import base64
+import hashlib
+import json
 import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from dataclasses import dataclass, field
 from io import BytesIO
+from typing import Protocol
+
 from PIL import Image
-from config import GENAI_AVAILABLE
+from caches import DiskLRUCache, image_content_hash
+from config import (GENAI_AVAILABLE, GEMINI_MODEL_NAME, GEMINI_API_BASE_URL, GEMINI_MAX_CONCURRENCY, GEMINI_TIMEOUT_SECONDS,
+                    GEMINI_DEADLINE_SECONDS, GEMINI_MAX_RETRIES, GEMINI_BACKOFF_BASE_SECONDS, GEMINI_BACKOFF_MAX_SECONDS,
+                    AI_EDIT_CACHE_DIR, AI_EDIT_CACHE_BYTES, AI_PAYLOAD_MAX_SIDE, AI_PAYLOAD_MAX_BYTES, AI_PAYLOAD_FORMAT,
+                    AI_PAYLOAD_MIN_QUALITY, AI_PAYLOAD_MAX_QUALITY)
+from telemetry import span, AI_EDIT_RESULTS
 
 if GENAI_AVAILABLE:
     import google.generativeai as genai
 
+# google.api_core exception class names that are worth retrying; matched by name so the import stays optional.
+TRANSIENT_ERROR_NAMES = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+    "DeadlineExceeded", "GatewayTimeout", "BadGateway", "Aborted",
+}
+TRANSIENT_HTTP_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class GeminiError(Exception):
+    """Raised when the Gemini call fails permanently or runs out of retries."""
+
+
+class GeminiTransientError(GeminiError):
+    """A failure worth retrying: rate limiting, a 5xx, or a timeout."""
+
+
+@dataclass
+class ImagePayload:
+    data: bytes
+    mime_type: str
+    size: tuple[int, int]
+    quality: int
+
+
+@dataclass
+class GeminiReply:
+    images: list[bytes] = field(default_factory=list)
+    text: str = ""
+
+
+class GeminiTransport(Protocol):
+    def generate(self, payload: ImagePayload, prompt: str, timeout: float) -> GeminiReply: ...
+
+
+class GenaiTransport:
+    """Calls Gemini through the google-generativeai SDK; the SDK is configured and the model built once."""
+
+    def __init__(self, api_key: str, model_name: str = GEMINI_MODEL_NAME):
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, payload: ImagePayload, prompt: str, timeout: float) -> GeminiReply:
+        try:
+            response = self.model.generate_content(
+                [{"mime_type": payload.mime_type, "data": payload.data}, prompt], request_options={"timeout": timeout}
+            )
+        except Exception as e:
+            if type(e).__name__ in TRANSIENT_ERROR_NAMES or isinstance(e, TimeoutError):
+                raise GeminiTransientError(f"{type(e).__name__}: {e}") from e
+            raise GeminiError(f"{type(e).__name__}: {e}") from e
+
+        if not (response.candidates and response.candidates[0].content and response.candidates[0].content.parts):
+            raise GeminiError("AI response is empty or malformed.")
+        parts = response.candidates[0].content.parts
+        images = [p.inline_data.data for p in parts if p.inline_data]
+        if images:
+            return GeminiReply(images=images)
+        try:
+            text = response.text
+        except Exception:
+            text = str(response.prompt_feedback)
+        return GeminiReply(text=text)
+
+
+class HttpTransport:
+    """Calls the Generative Language REST API (`models/<model>:generateContent`) at `base_url` with urllib.
+
+    Needs no SDK, so it also works against a local stub server for testing.
+    """
+
+    def __init__(self, base_url: str, api_key: str | None = None, model_name: str = GEMINI_MODEL_NAME):
+        self.url = f"{base_url.rstrip('/')}/v1beta/models/{model_name}:generateContent"
+        self.api_key = api_key
+
+    def generate(self, payload: ImagePayload, prompt: str, timeout: float) -> GeminiReply:
+        body = json.dumps({"contents": [{"parts": [
+            {"inline_data": {"mime_type": payload.mime_type, "data": base64.b64encode(payload.data).decode()}},
+            {"text": prompt},
+        ]}]}).encode()
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["x-goog-api-key"] = self.api_key
+        request = urllib.request.Request(self.url, data=body, headers=headers, method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                payload = json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            error = GeminiTransientError if e.code in TRANSIENT_HTTP_STATUSES else GeminiError
+            raise error(f"HTTP {e.code}: {e.reason}") from e
+        except (urllib.error.URLError, TimeoutError, ConnectionError) as e:
+            raise GeminiTransientError(f"{type(e).__name__}: {e}") from e
+
+        candidates = payload.get("candidates") or []
+        parts = (candidates[0].get("content") or {}).get("parts") if candidates else None
+        if not parts:
+            raise GeminiError("AI response is empty or malformed.")
+        images = [base64.b64decode(p[key]["data"]) for p in parts for key in ("inline_data", "inlineData") if key in p]
+        if images:
+            return GeminiReply(images=images)
+        return GeminiReply(text=" ".join(p["text"] for p in parts if "text" in p) or json.dumps(payload.get("promptFeedback")))
+
+
+class GeminiClient:
+    """Long-lived Gemini client: at most `max_concurrency` calls in flight, each attempt bounded by `timeout`,
+    transient failures retried with full-jitter exponential backoff until `max_retries` or the overall deadline."""
 
-def run_enhanced_ai_edit(crude_collage_image: Image.Image, user_prompt: str):
-    if not GENAI_AVAILABLE:
-        return None, "❌ Gemini library not found."
+    def __init__(self, transport: GeminiTransport, max_concurrency: int = GEMINI_MAX_CONCURRENCY,
+                 timeout: float = GEMINI_TIMEOUT_SECONDS, deadline: float = GEMINI_DEADLINE_SECONDS,
+                 max_retries: int = GEMINI_MAX_RETRIES, backoff_base: float = GEMINI_BACKOFF_BASE_SECONDS,
+                 backoff_max: float = GEMINI_BACKOFF_MAX_SECONDS):
+        self.transport = transport
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._slots = threading.BoundedSemaphore(max_concurrency)
 
-    api_key = os.getenv("GOOGLE_AI_STUDIO_API_KEY")
-    if not api_key:
-        return None, "❌ GOOGLE_AI_STUDIO_API_KEY not found."
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
 
+    def generate(self, payload: ImagePayload, prompt: str, deadline: float | None = None) -> GeminiReply:
+        """Blocking call. `deadline` (seconds from now) bounds queueing, all attempts and backoff together."""
+        expires_at = time.monotonic() + (self.deadline if deadline is None else deadline)
+        if not self._slots.acquire(timeout=max(0.0, expires_at - time.monotonic())):
+            raise GeminiTransientError("Timed out waiting for a free Gemini slot.")
+        try:
+            attempt = 0
+            while True:
+                remaining = expires_at - time.monotonic()
+                if remaining <= 0:
+                    raise GeminiTransientError("Gemini deadline exceeded.")
+                try:
+                    return self.transport.generate(payload, prompt, min(self.timeout, remaining))
+                except GeminiTransientError as e:
+                    delay = self.backoff(attempt)
+                    attempt += 1
+                    if attempt > self.max_retries or time.monotonic() + delay >= expires_at:
+                        raise GeminiTransientError(f"Gave up after {attempt} attempts: {e}") from e
+                    print(f"Gemini call failed ({e}); retry {attempt}/{self.max_retries} in {delay:.1f}s.")
+                    time.sleep(delay)
+        finally:
+            self._slots.release()
+
+    async def agenerate(self, payload: ImagePayload, prompt: str, deadline: float | None = None) -> GeminiReply:
+        """Async entry point; the blocking call runs on the default executor."""
+        return await asyncio.to_thread(self.generate, payload, prompt, deadline)
+
+
+_client: GeminiClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_gemini_client() -> GeminiClient:
+    """Returns the process-wide client, built on first use. Raises GeminiError when it cannot be configured."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            api_key = os.getenv("GOOGLE_AI_STUDIO_API_KEY")
+            if GEMINI_API_BASE_URL:
+                transport = HttpTransport(GEMINI_API_BASE_URL, api_key)
+            elif not GENAI_AVAILABLE:
+                raise GeminiError("Gemini library not found.")
+            elif not api_key:
+                raise GeminiError("GOOGLE_AI_STUDIO_API_KEY not found.")
+            else:
+                transport = GenaiTransport(api_key)
+            _client = GeminiClient(transport)
+        return _client
+
+
+def build_edit_prompt(user_prompt: str) -> str:
     base_prompt = (
         "You are a photorealistic integration specialist. You will receive a single image that is a crude collage. "
         "This collage contains the **exact assets** to be used and their **final, correct composition.**\n\n"
@@ -29,30 +209,101 @@ def run_enhanced_ai_edit(crude_collage_image: Image.Image, user_prompt: str):
         "3.  **DO NOT ADD OR REMOVE** any objects."
     )
 
-    final_prompt = (
+    return (
         f"{base_prompt}\n\n"
         f"Apply this final user instruction to the overall mood and style: \"{user_prompt}\""
         if user_prompt else base_prompt
     )
-    
-    try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel("gemini-2.5-flash-image-preview")
 
-        response = model.generate_content(
-            [crude_collage_image, final_prompt]
-        )
 
-        if not (response.candidates and response.candidates[0].content and response.candidates[0].content.parts):
-            return None, "❌ AI response is empty or malformed."
-
-        image_parts = [p.inline_data.data for p in response.candidates[0].content.parts if p.inline_data]
-        if image_parts:
-            result_image = Image.open(BytesIO(image_parts[0]))
-            return result_image, "✅ Enhanced AI Edit successful!"
-        else:
-            refusal_text = response.text if hasattr(response, 'text') else str(response.prompt_feedback)
-            return None, f"❌ AI did not return an image. Reason: {refusal_text}"
-
-    except Exception as e:
-        return None, f"❌ An error occurred with the AI Edit: {type(e).__name__}: {e}"
\ No newline at end of file
+def _encode(image: Image.Image, image_format: str, quality: int) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, quality=quality)
+    return buffer.getvalue()
+
+
+def encode_payload(image: Image.Image, max_side: int = AI_PAYLOAD_MAX_SIDE, max_bytes: int = AI_PAYLOAD_MAX_BYTES,
+                   image_format: str = AI_PAYLOAD_FORMAT, min_quality: int = AI_PAYLOAD_MIN_QUALITY,
+                   max_quality: int = AI_PAYLOAD_MAX_QUALITY) -> ImagePayload:
+    """Downscales to `max_side` and binary-searches the highest quality whose encoding fits `max_bytes`.
+
+    If even `min_quality` is too large, the image is shrunk further and the search repeats.
+    """
+    image = image.convert("RGB")
+    scale = min(1.0, max_side / max(image.size))
+    while True:
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        resized = image if size == image.size else image.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        # Most collages fit at full quality; only search when they do not.
+        data = _encode(resized, image_format, max_quality)
+        if len(data) <= max_bytes:
+            return ImagePayload(data, f"image/{image_format.lower()}", size, max_quality)
+        best, low, high = None, min_quality, max_quality - 1
+        while low <= high:
+            quality = (low + high) // 2
+            data = _encode(resized, image_format, quality)
+            if len(data) <= max_bytes:
+                best, low = (data, quality), quality + 1
+            else:
+                high = quality - 1
+        if best is not None or max(size) <= 64:
+            data, quality = best or (_encode(resized, image_format, min_quality), min_quality)
+            return ImagePayload(data, f"image/{image_format.lower()}", size, quality)
+        scale *= 0.8
+
+
+def payload_policy_key() -> str:
+    return f"{AI_PAYLOAD_MAX_SIDE}:{AI_PAYLOAD_MAX_BYTES}:{AI_PAYLOAD_FORMAT}:{AI_PAYLOAD_MIN_QUALITY}-{AI_PAYLOAD_MAX_QUALITY}"
+
+
+def restore_size(result_image: Image.Image, size: tuple[int, int]) -> Image.Image:
+    """Brings the generated image back to the room photo's dimensions so placement matches the collage."""
+    if result_image.size == size:
+        return result_image
+    return result_image.convert("RGB").resize(size, Image.Resampling.LANCZOS)
+
+
+# Generated images as returned by Gemini, keyed by collage content + final prompt + model + payload policy.
+ai_edit_cache = DiskLRUCache(AI_EDIT_CACHE_DIR, AI_EDIT_CACHE_BYTES, suffix=".img")
+
+def ai_edit_cache_key(crude_collage_image: Image.Image, final_prompt: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (image_content_hash(crude_collage_image), GEMINI_MODEL_NAME, payload_policy_key(), final_prompt):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def run_enhanced_ai_edit(crude_collage_image: Image.Image, user_prompt: str, regenerate: bool = False):
+    """Returns (image, status). Identical collage + prompt pairs are served from disk unless `regenerate` is set."""
+    final_prompt = build_edit_prompt(user_prompt)
+    cache_key = ai_edit_cache_key(crude_collage_image, final_prompt)
+    if not regenerate:
+        cached = ai_edit_cache.get(cache_key)
+        if cached is not None:
+            AI_EDIT_RESULTS.inc(outcome="cached")
+            return restore_size(Image.open(BytesIO(cached)), crude_collage_image.size), "✅ Enhanced AI Edit successful! (cached result)"
+
+    start = time.perf_counter()
+    with span("payload_encode"):
+        payload = encode_payload(crude_collage_image)
+    encoded = time.perf_counter()
+    try:
+        with span("gemini_generate", payload_bytes=len(payload.data)):
+            reply = get_gemini_client().generate(payload, final_prompt)
+    except GeminiError as e:
+        AI_EDIT_RESULTS.inc(outcome="error")
+        return None, f"❌ An error occurred with the AI Edit: {e}"
+    generated = time.perf_counter()
+
+    if reply.images:
+        with span("result_restore"):
+            result_image = restore_size(Image.open(BytesIO(reply.images[0])), crude_collage_image.size)
+        ai_edit_cache.put(cache_key, reply.images[0])
+        AI_EDIT_RESULTS.inc(outcome="success")
+        print(f"AI edit: sent {payload.size[0]}x{payload.size[1]} {payload.mime_type} q{payload.quality} "
+              f"({len(payload.data) / 1024:.0f} KiB); encode {encoded - start:.2f}s, generate {generated - encoded:.2f}s, "
+              f"restore {time.perf_counter() - generated:.2f}s")
+        return result_image, "✅ Enhanced AI Edit successful!"
+    AI_EDIT_RESULTS.inc(outcome="no_image")
+    return None, f"❌ AI did not return an image. Reason: {reply.text}"
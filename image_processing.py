@@ -1,3 +1,6 @@
+import time
+from typing import Callable
+
 import cv2
 import numpy as np
 from PIL import Image
@@ -6,64 +9,363 @@ from torchvision.ops import nms
 from segment_anything import SamPredictor
 from transformers import AutoProcessor, AutoModelForZeroShotObjectDetection
 
-from config import DEVICE, NAMED_COLORS, detection_results
-from drawing import draw_contours_with_selection
+from caches import ByteLRUCache, image_content_hash
+from config import (DEVICE, NAMED_COLORS, SAM_EMBEDDING_CACHE_BYTES, GD_RESULT_CACHE_BYTES,
+                    GD_BOX_THRESHOLD, GD_TEXT_THRESHOLD, GD_BATCH_SIZE, SAM_ENCODER_BATCH_SIZE, MAX_INFERENCE_SIDE,
+                    ROI_DETECTION, ROI_MAX_REGIONS, ROI_PADDING_RATIO, ROI_MIN_PADDING, ROI_MIN_REGION_AREA_RATIO,
+                    ROI_MAX_COVERAGE, ROI_GD_SIZE, SAM_DECODE_MEMORY_BUDGET_BYTES)
+from drawing import draw_contours_with_selection, mark_overlay_dirty
+from masks import CompactMask
 from editor_logic import get_next_id, get_annotations_info
+from annotation_index import get_annotation_index
+from telemetry import span, observe_stage, DETECTED_OBJECTS, SAM_DECODE_PEAK_BYTES
 
-def detect_hf_grounding_dino_raw(image_pil: Image.Image, text_prompt: str, processor, model) -> dict:
-    inputs = processor(images=image_pil, text=text_prompt, return_tensors="pt").to(DEVICE)
-    with torch.no_grad():
-        outputs = model(**inputs)
-    return processor.post_process_grounded_object_detection(
-        outputs, inputs.input_ids, target_sizes=[image_pil.size[::-1]]
-    )[0]
+def inference_scale(size: tuple[int, int], max_side: int | None = MAX_INFERENCE_SIDE) -> float:
+    """Factor (<= 1) that brings an image of `size` within `max_side` on its longest edge."""
+    return min(1.0, max_side / max(size)) if max_side else 1.0
 
-def segment_sam(image_rgb_numpy: np.ndarray, sam_predictor: SamPredictor, boxes_xyxy: torch.Tensor) -> torch.Tensor:
-    sam_predictor.set_image(image_rgb_numpy)
-    transformed_boxes = sam_predictor.transform.apply_boxes_torch(boxes_xyxy.to(DEVICE), image_rgb_numpy.shape[:2])
-    masks, _, _ = sam_predictor.predict_torch(
-        point_coords=None, point_labels=None, boxes=transformed_boxes, multimask_output=False,
-    )
-    return masks.cpu()
+def downscale_for_inference(image_pil: Image.Image, scale: float) -> Image.Image:
+    if scale >= 1.0:
+        return image_pil
+    new_size = (max(1, round(image_pil.width * scale)), max(1, round(image_pil.height * scale)))
+    return image_pil.resize(new_size, Image.Resampling.BILINEAR, reducing_gap=2.0)
 
-def run_detection_and_populate_editor(empty_img_path, staged_img_pil: Image.Image, prompts_str, processor, model, predictor):
-    empty_img_pil = Image.open(empty_img_path).convert("RGB")
-    detection_results.update({"empty_image": empty_img_pil, "staged_image": staged_img_pil, "selected_staged": None})
-    
-    staged_img_np = np.array(staged_img_pil)
-    
-    diff_mask = cv2.dilate(cv2.absdiff(np.array(empty_img_pil), staged_img_np), np.ones((5,5),np.uint8))
-    changed_pixels_mask = np.any(diff_mask > 30, axis=2)
+def mask_crop_to_geometry(crop: np.ndarray, x0: int, y0: int, mask_shape: tuple[int, int],
+                          output_shape: tuple[int, int]) -> tuple[CompactMask, np.ndarray] | None:
+    """Turns a mask crop at (x0, y0) in a `mask_shape` frame into a CompactMask and main contour in `output_shape`.
+
+    When the frames differ (inference ran on a downscaled copy) only the crop is upsampled, and the
+    contour is traced at output resolution.
+    """
+    if tuple(mask_shape) != tuple(output_shape):
+        scale_y, scale_x = output_shape[0] / mask_shape[0], output_shape[1] / mask_shape[1]
+        x1, y1 = x0 + crop.shape[1], y0 + crop.shape[0]
+        x0, y0 = int(np.floor(x0 * scale_x)), int(np.floor(y0 * scale_y))
+        x1, y1 = min(output_shape[1], int(np.ceil(x1 * scale_x))), min(output_shape[0], int(np.ceil(y1 * scale_y)))
+        crop = cv2.resize(crop.astype(np.uint8) * 255, (x1 - x0, y1 - y0), interpolation=cv2.INTER_LINEAR) > 127
+
+    # A 1px zero border keeps contours identical to running findContours on the full frame.
+    padded = np.pad(crop.astype(np.uint8), 1)
+    contours, _ = cv2.findContours(padded, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(x0 - 1, y0 - 1))
+    if not contours:
+        return None
+    main_contour = max(contours, key=cv2.contourArea)
+    return CompactMask.from_crop(output_shape, x0, y0, crop), main_contour
 
+# Grounding DINO results keyed by (model, image content hash, prompt text, thresholds).
+gd_result_cache = ByteLRUCache(GD_RESULT_CACHE_BYTES)
+
+def prompt_query(prompts_str: str) -> str:
+    """Builds the Grounding DINO text query from a comma-separated prompt string, keeping the user's order and case."""
     prompts = [p.strip() for p in prompts_str.split(',') if p.strip()] or ["object"]
-    gd_results = detect_hf_grounding_dino_raw(staged_img_pil, ". ".join(prompts) + ".", processor, model)
-    gd_boxes = gd_results.get('boxes', torch.tensor([])) 
-    
-    if len(gd_boxes) == 0:
-        detection_results["staged_annotations"] = []
-        return staged_img_pil, "❌ No objects detected", "", {}
+    return ". ".join(prompts) + "."
 
-    sam_masks = segment_sam(staged_img_np, predictor, gd_boxes)
-    
+def normalize_prompts(prompts_str: str) -> str:
+    """Lowercased, de-duplicated, sorted form of a prompt string, used only in cache keys so equivalent prompts share entries."""
+    prompts = sorted({p.strip().lower() for p in prompts_str.split(',') if p.strip()})
+    return ",".join(prompts or ["object"])
+
+def _gd_cache_key(model, image_key: str, prompt_key: str, size: dict | None = None) -> str:
+    return "|".join([getattr(model, "name_or_path", ""), image_key, prompt_key, f"{GD_BOX_THRESHOLD:g}", f"{GD_TEXT_THRESHOLD:g}",
+                     str(sorted(size.items())) if size else ""])
+
+def _compact_gd_result(results: dict) -> dict:
+    # Keep only small detached CPU tensors; the raw model outputs are not retained.
+    compact = {
+        "boxes": results["boxes"].detach().to("cpu", torch.float32).contiguous(),
+        "scores": results["scores"].detach().to("cpu", torch.float16).contiguous(),
+    }
+    for label_key in ("labels", "text_labels"):
+        if label_key in results:
+            labels = results[label_key]
+            compact[label_key] = labels.detach().cpu() if isinstance(labels, torch.Tensor) else list(labels)
+    return compact
+
+def detect_hf_grounding_dino_batch(images_pil: list[Image.Image], text_prompts: list[str], processor, model,
+                                   image_keys: list[str] | None = None, size: dict | None = None,
+                                   prompt_keys: list[str] | None = None) -> list[dict]:
+    """Runs Grounding DINO over several images in padded batches, skipping images whose result is already memoized.
+
+    `size` overrides the processor's resize target (e.g. to avoid upscaling small crops). `prompt_keys` (see
+    `normalize_prompts`) replace the text queries in the memo key so equivalent prompt strings share entries.
+    """
+    image_keys = image_keys or [image_content_hash(img) for img in images_pil]
+    prompt_keys = prompt_keys or text_prompts
+    cache_keys = [_gd_cache_key(model, k, t, size) for k, t in zip(image_keys, prompt_keys)]
+    size_kwargs = {"size": size} if size else {}
+    results: list[dict | None] = [gd_result_cache.get(k) for k in cache_keys]
+
+    pending = [i for i, r in enumerate(results) if r is None]
+    for start in range(0, len(pending), GD_BATCH_SIZE):
+        chunk = pending[start:start + GD_BATCH_SIZE]
+        inputs = processor(
+            images=[images_pil[i] for i in chunk], text=[text_prompts[i] for i in chunk],
+            padding=True, return_tensors="pt", **size_kwargs
+        ).to(DEVICE)
+        with torch.no_grad(), span("grounding_dino", images=len(chunk)):
+            outputs = model(**inputs)
+        chunk_results = processor.post_process_grounded_object_detection(
+            outputs, inputs.input_ids, threshold=GD_BOX_THRESHOLD, text_threshold=GD_TEXT_THRESHOLD,
+            target_sizes=[images_pil[i].size[::-1] for i in chunk]
+        )
+        for i, result in zip(chunk, chunk_results):
+            results[i] = _compact_gd_result(result)
+            gd_result_cache.put(cache_keys[i], results[i])
+
+    return [dict(r) for r in results]
+
+def detect_hf_grounding_dino_raw(image_pil: Image.Image, text_prompt: str, processor, model, image_key: str | None = None) -> dict:
+    return detect_hf_grounding_dino_batch([image_pil], [text_prompt], processor, model, [image_key] if image_key else None)[0]
+
+# Image-encoder outputs keyed by image content hash; the encoder dominates SAM cost, the decoder is cheap.
+sam_embedding_cache = ByteLRUCache(SAM_EMBEDDING_CACHE_BYTES)
+
+def encode_sam_batch(sam_predictor: SamPredictor, images_rgb_numpy: list[np.ndarray], image_keys: list[str]) -> None:
+    """Runs the SAM image encoder once over all images missing from the embedding cache and stores their features."""
+    pending = [i for i, key in enumerate(image_keys) if key not in sam_embedding_cache]
+    sam = sam_predictor.model
+    for start in range(0, len(pending), SAM_ENCODER_BATCH_SIZE):
+        chunk = pending[start:start + SAM_ENCODER_BATCH_SIZE]
+        # Same preprocessing as SamPredictor.set_image; `preprocess` pads every image to a square encoder input.
+        batch, input_sizes = [], []
+        for i in chunk:
+            input_image = sam_predictor.transform.apply_image(images_rgb_numpy[i])
+            input_image_torch = torch.as_tensor(input_image, device=DEVICE).permute(2, 0, 1).contiguous()
+            input_sizes.append(tuple(input_image_torch.shape[-2:]))
+            batch.append(sam.preprocess(input_image_torch))
+        with torch.no_grad(), span("sam_encode", images=len(chunk)):
+            features = sam.image_encoder(torch.stack(batch))
+        for j, i in enumerate(chunk):
+            sam_embedding_cache.put(image_keys[i], (features[j:j + 1].clone(), images_rgb_numpy[i].shape[:2], input_sizes[j]))
+
+def set_image_cached(sam_predictor: SamPredictor, image_rgb_numpy: np.ndarray, image_key: str | None = None) -> str:
+    """Equivalent to `sam_predictor.set_image`, but restores cached features instead of re-running the encoder."""
+    key = image_key or image_content_hash(image_rgb_numpy)
+    cached = sam_embedding_cache.get(key)
+    if cached is not None:
+        features, original_size, input_size = cached
+        sam_predictor.reset_image()
+        sam_predictor.features = features
+        sam_predictor.original_size = original_size
+        sam_predictor.input_size = input_size
+        sam_predictor.is_image_set = True
+        return key
+
+    with span("sam_encode", images=1):
+        sam_predictor.set_image(image_rgb_numpy)
+    sam_embedding_cache.put(key, (sam_predictor.features, sam_predictor.original_size, sam_predictor.input_size))
+    return key
+
+# SAM upsamples low-res logits to its fixed square encoder input before cropping and resizing to the image.
+_SAM_INPUT_SIDE = 1024
+
+def sam_decode_bytes_per_box(mask_shape: tuple[int, int]) -> int:
+    """Transient memory one box costs in `predict_torch`: float32 frames at the encoder input and image size, plus the bool mask."""
+    height, width = mask_shape
+    return 4 * _SAM_INPUT_SIDE ** 2 + 5 * height * width
+
+def segment_sam_filtered(image_rgb_numpy: np.ndarray, sam_predictor: SamPredictor, boxes_xyxy: torch.Tensor,
+                         changed_pixels_mask: np.ndarray, output_shape: tuple[int, int] | None = None,
+                         image_key: str | None = None,
+                         budget_bytes: int = SAM_DECODE_MEMORY_BUDGET_BYTES) -> list[tuple[CompactMask, np.ndarray]]:
+    """Box-prompted SAM masks, passed through `filter_sam_masks`, decoded in chunks that fit `budget_bytes`.
+
+    Each chunk is filtered and compacted before the next one is decoded, so the dense `[N,1,H,W]` batch never
+    exists at once and peak memory no longer grows with the number of boxes. On a device OOM the chunk is halved
+    and retried. The peak (measured on CUDA, estimated on CPU) goes to `app_sam_decode_peak_bytes`.
+    """
+    set_image_cached(sam_predictor, image_rgb_numpy, image_key)
+    transformed_boxes = sam_predictor.transform.apply_boxes_torch(boxes_xyxy.to(DEVICE), image_rgb_numpy.shape[:2])
+    per_box = sam_decode_bytes_per_box(image_rgb_numpy.shape[:2])
+    chunk_size = max(1, budget_bytes // per_box)
+    cuda = DEVICE.type == 'cuda'
+    if cuda:
+        torch.cuda.reset_peak_memory_stats()
+        baseline = torch.cuda.memory_allocated()
+
+    results, peak_bytes, decode_seconds, filter_seconds = [], 0, 0.0, 0.0
+    start = 0
+    while start < len(transformed_boxes):
+        chunk = transformed_boxes[start:start + chunk_size]
+        t0 = time.perf_counter()
+        try:
+            masks, _, _ = sam_predictor.predict_torch(point_coords=None, point_labels=None, boxes=chunk, multimask_output=False)
+        except (torch.cuda.OutOfMemoryError, MemoryError):
+            if chunk_size == 1:
+                raise
+            chunk_size = max(1, chunk_size // 2)
+            if cuda:
+                torch.cuda.empty_cache()
+            continue
+        t1 = time.perf_counter()
+        results += filter_sam_masks(masks, changed_pixels_mask, output_shape=output_shape)
+        del masks
+        filter_seconds += time.perf_counter() - t1
+        decode_seconds += t1 - t0
+        peak_bytes = max(peak_bytes, len(chunk) * per_box)
+        start += len(chunk)
+
+    if cuda:
+        peak_bytes = torch.cuda.max_memory_allocated() - baseline
+    SAM_DECODE_PEAK_BYTES.observe(peak_bytes)
+    observe_stage("sam_decode", decode_seconds, boxes=len(boxes_xyxy), chunk_size=chunk_size, peak_bytes=peak_bytes)
+    observe_stage("mask_postprocess", filter_seconds, masks=len(boxes_xyxy))
+    return results
+
+def mask_bounding_boxes(masks: torch.Tensor) -> list[tuple[int, int, int, int]]:
+    """Tight `(x0, y0, x1, y1)` boxes for a `[N,H,W]` bool mask batch, from two batched max-reductions on the mask device."""
+    as_bytes = masks.view(torch.uint8)
+    rows, cols = as_bytes.amax(dim=2), as_bytes.amax(dim=1)
+    height, width = masks.shape[-2:]
+    present = rows.amax(dim=1) > 0
+    boxes = torch.stack([
+        cols.argmax(dim=1), rows.argmax(dim=1),
+        width - cols.flip(1).argmax(dim=1), height - rows.flip(1).argmax(dim=1),
+    ], dim=1)
+    return (boxes * present[:, None]).tolist()
+
+def filter_sam_masks(sam_masks: torch.Tensor, changed_pixels_mask: np.ndarray, min_area: int = 200,
+                     min_changed_ratio: float = 0.6, output_shape: tuple[int, int] | None = None) -> list[tuple[CompactMask, np.ndarray]]:
+    """Filters a `[N,1,H,W]` SAM mask batch where it lives and extracts contours from the survivors' crops only.
+
+    Bounding boxes come from batched reductions, areas and changed-pixel overlaps are counted before
+    anything is copied, and only kept masks' crops reach OpenCV. `min_area` is in output pixels; with an
+    `output_shape` larger than the masks, survivors are upsampled to it. Returns `(mask, main_contour)` pairs in input order.
+    """
+    if len(sam_masks) == 0:
+        return []
+    masks = sam_masks[:, 0].bool()
+    boxes = mask_bounding_boxes(masks)
+
+    if masks.device.type == 'cpu':
+        # torch's bool reductions are slow on CPU; numpy counts each bbox crop of the same memory instead.
+        dense = masks.numpy()
+        areas = [np.count_nonzero(dense[i, y0:y1, x0:x1]) for i, (x0, y0, x1, y1) in enumerate(boxes)]
+        overlaps = [np.count_nonzero(dense[i, y0:y1, x0:x1] & changed_pixels_mask[y0:y1, x0:x1]) if area else 0
+                    for i, ((x0, y0, x1, y1), area) in enumerate(zip(boxes, areas))]
+    else:
+        changed = torch.as_tensor(changed_pixels_mask, device=masks.device)
+        areas = masks.flatten(1).sum(dim=1).tolist()
+        overlaps = (masks & changed).flatten(1).sum(dim=1).tolist()
+
+    mask_shape = tuple(masks.shape[-2:])
+    output_shape = tuple(output_shape or mask_shape)
+    area_scale = (output_shape[0] * output_shape[1]) / (mask_shape[0] * mask_shape[1])
+    results = []
+    for i, ((x0, y0, x1, y1), area, overlap) in enumerate(zip(boxes, areas, overlaps)):
+        if not area or area * area_scale < min_area or overlap / area < min_changed_ratio:
+            continue
+        geometry = mask_crop_to_geometry(masks[i, y0:y1, x0:x1].cpu().numpy(), x0, y0, mask_shape, output_shape)
+        if geometry is None: continue
+        results.append(geometry)
+    return results
+
+def changed_pixels(empty_img_np: np.ndarray, staged_img_np: np.ndarray) -> np.ndarray:
+    """Boolean mask of pixels that differ noticeably between the empty and staged photos, dilated to close small gaps."""
+    diff_mask = cv2.dilate(cv2.absdiff(empty_img_np, staged_img_np), np.ones((5,5),np.uint8))
+    return np.any(diff_mask > 30, axis=2)
+
+def _merge_boxes(a: tuple[int, int, int, int], b: tuple[int, int, int, int]) -> tuple[int, int, int, int]:
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+def _box_area(box: tuple[int, int, int, int]) -> int:
+    return (box[2] - box[0]) * (box[3] - box[1])
+
+def changed_regions(changed_pixels_mask: np.ndarray, max_regions: int = ROI_MAX_REGIONS,
+                    min_area_ratio: float = ROI_MIN_REGION_AREA_RATIO,
+                    max_coverage: float = ROI_MAX_COVERAGE) -> list[tuple[int, int, int, int]]:
+    """Padded `(x0, y0, x1, y1)` crops around the connected changed regions, merged into at most `max_regions`.
+
+    Returns `[]` when nothing changed, and the whole frame when the crops would cover more than `max_coverage` of it.
+    """
+    height, width = changed_pixels_mask.shape
+    full_frame = [(0, 0, width, height)]
+    # Close small gaps so one object's diff is one component rather than many fragments.
+    closed = cv2.morphologyEx(changed_pixels_mask.astype(np.uint8), cv2.MORPH_CLOSE, np.ones((15, 15), np.uint8))
+    count, _, stats, _ = cv2.connectedComponentsWithStats(closed, connectivity=8)
+    min_area = min_area_ratio * height * width
+
+    boxes = []
+    for x, y, w, h, area in stats[1:count].tolist():
+        if area < min_area: continue
+        pad = max(ROI_MIN_PADDING, int(ROI_PADDING_RATIO * max(w, h)))
+        boxes.append((max(0, x - pad), max(0, y - pad), min(width, x + w + pad), min(height, y + h + pad)))
+
+    # Merge overlapping crops so no object is detected twice, then the cheapest pairs until few enough remain.
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    boxes[i] = _merge_boxes(a, b)
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged: break
+    while len(boxes) > max_regions:
+        _, i, j = min((_box_area(_merge_boxes(boxes[i], boxes[j])) - _box_area(boxes[i]) - _box_area(boxes[j]), i, j)
+                      for i in range(len(boxes)) for j in range(i + 1, len(boxes)))
+        boxes[i] = _merge_boxes(boxes[i], boxes[j])
+        del boxes[j]
+
+    if sum(_box_area(b) for b in boxes) > max_coverage * height * width:
+        return full_frame
+    return boxes
+
+def detect_in_regions(infer_pils: list[Image.Image], text_prompts: list[str], regions_per_image: list[list[tuple]],
+                      image_keys: list[str], processor, model, prompt_keys: list[str] | None = None) -> list[dict]:
+    """Runs Grounding DINO on each image's crops only and stitches the boxes back into image coordinates."""
+    prompt_keys = prompt_keys or text_prompts
+    crops, crop_prompts, crop_prompt_keys, crop_keys, owners = [], [], [], [], []
+    full, full_prompts, full_prompt_keys, full_keys, full_owners = [], [], [], [], []
+    for i, (infer_pil, text_prompt, regions) in enumerate(zip(infer_pils, text_prompts, regions_per_image)):
+        for region in regions:
+            if region == (0, 0, infer_pil.width, infer_pil.height):
+                full.append(infer_pil); full_prompts.append(text_prompt); full_prompt_keys.append(prompt_keys[i])
+                full_keys.append(image_keys[i]); full_owners.append((i, region))
+                continue
+            crop = infer_pil.crop(region)
+            crops.append(crop); crop_prompts.append(text_prompt); crop_prompt_keys.append(prompt_keys[i])
+            crop_keys.append(image_content_hash(crop)); owners.append((i, region))
+
+    per_image: list[list[dict]] = [[] for _ in infer_pils]
+    crop_results = detect_hf_grounding_dino_batch(crops, crop_prompts, processor, model, crop_keys, size=ROI_GD_SIZE,
+                                                  prompt_keys=crop_prompt_keys) if crops else []
+    full_results = detect_hf_grounding_dino_batch(full, full_prompts, processor, model, full_keys,
+                                                  prompt_keys=full_prompt_keys) if full else []
+    for (i, (x0, y0, _, _)), result in zip(owners + full_owners, crop_results + full_results):
+        if len(result.get('boxes', [])) > 0:
+            result['boxes'] = result['boxes'] + torch.tensor([x0, y0, x0, y0], dtype=result['boxes'].dtype)
+        per_image[i].append(result)
+
+    stitched = []
+    for results in per_image:
+        results = [r for r in results if len(r.get('boxes', [])) > 0]
+        if not results:
+            stitched.append({'boxes': torch.zeros((0, 4))})
+            continue
+        merged = {'boxes': torch.cat([r['boxes'] for r in results]), 'scores': torch.cat([r['scores'] for r in results])}
+        for label_key in ("labels", "text_labels"):
+            if all(label_key in r for r in results):
+                labels = [r[label_key] for r in results]
+                merged[label_key] = torch.cat(labels) if isinstance(labels[0], torch.Tensor) else [l for ls in labels for l in ls]
+        stitched.append(merged)
+    return stitched
+
+def annotations_from_geometry(state: dict, geometry: list[tuple[CompactMask, np.ndarray]]) -> list[dict]:
+    """Editor annotations, with fresh ids and cycling colors, for filtered `(mask, main_contour)` pairs."""
     annotations = []
     colors = list(NAMED_COLORS.keys())
-    for i, mask_tensor in enumerate(sam_masks):
-        mask = mask_tensor[0].numpy()
-        
-        if np.sum(mask) < 200 or np.sum(np.logical_and(mask, changed_pixels_mask)) / np.sum(mask) < 0.6:
-            continue
-            
-        contours, _ = cv2.findContours(mask.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        if not contours: continue
-        
-        main_contour = max(contours, key=cv2.contourArea)
+    for mask, main_contour in geometry:
         bbox = cv2.boundingRect(main_contour)
         
         color_name = colors[len(annotations) % len(colors)]
         color_data = NAMED_COLORS[color_name]
         
         annotations.append({
-            "id": get_next_id(),
+            "id": get_next_id(state),
             "mask": mask,
             "contour": main_contour,
             "bbox": bbox,
@@ -72,16 +374,185 @@ def run_detection_and_populate_editor(empty_img_path, staged_img_pil: Image.Imag
             "hex_color": color_data["hex"],
             "manual": False
         })
-        
-    detection_results["staged_annotations"] = annotations
-    staged_with_contours = draw_contours_with_selection(staged_img_pil, annotations)
-    
-    return staged_with_contours, f"✅ Detected {len(annotations)} objects.", get_annotations_info("staged"), {}
+    return annotations
+
+def prepare_detection_input(empty_img_pil: Image.Image, staged_img_pil: Image.Image, prompts_str: str,
+                            max_side: int | None = MAX_INFERENCE_SIDE) -> dict:
+    """Model-free front half of detection for one pair: inference-size copies, the changed-pixel mask, the staged
+    image's content key and the Grounding DINO prompt. Cheap to pickle, so it can run in worker processes."""
+    with span("downscale_diff"):
+        scale = inference_scale(staged_img_pil.size, max_side)
+        infer_pil = downscale_for_inference(staged_img_pil, scale)
+        staged_img_np = np.array(infer_pil)
+        empty_rgb = empty_img_pil if empty_img_pil.mode == "RGB" else empty_img_pil.convert("RGB")
+        empty_img_np = np.array(downscale_for_inference(empty_rgb, scale))
+        changed_mask = changed_pixels(empty_img_np, staged_img_np)
+    return {
+        "infer_pil": infer_pil,
+        "staged_np": staged_img_np,
+        "staged_key": image_content_hash(staged_img_np),
+        "text_prompt": prompt_query(prompts_str),
+        "prompt_key": normalize_prompts(prompts_str),
+        "changed_mask": changed_mask,
+        "output_shape": staged_img_pil.size[::-1],
+    }
+
+def segment_prepared_inputs(states: list[dict], prepared: list[dict], processor, model, predictor,
+                            roi: bool = ROI_DETECTION, progress: Callable[[str], None] | None = None) -> list[list[dict] | None]:
+    """Model half of detection: batched Grounding DINO and SAM over `prepare_detection_input` outputs.
+
+    Sets `state["staged_annotations"]` for each pair and returns the annotation lists, with None for pairs
+    where Grounding DINO found nothing.
+    """
+    progress = progress or (lambda stage: None)
+    infer_pils = [p["infer_pil"] for p in prepared]
+    staged_keys = [p["staged_key"] for p in prepared]
+    text_prompts = [p["text_prompt"] for p in prepared]
+    prompt_keys = [p["prompt_key"] for p in prepared]
+
+    progress("grounding_dino")
+    if roi:
+        regions = [changed_regions(p["changed_mask"]) for p in prepared]
+        all_gd_results = detect_in_regions(infer_pils, text_prompts, regions, staged_keys, processor, model, prompt_keys)
+    else:
+        all_gd_results = detect_hf_grounding_dino_batch(infer_pils, text_prompts, processor, model, staged_keys,
+                                                        prompt_keys=prompt_keys)
+
+    with_boxes = [i for i, r in enumerate(all_gd_results) if len(r.get('boxes', [])) > 0]
+    progress("segmenting")
+    encode_sam_batch(predictor, [prepared[i]["staged_np"] for i in with_boxes], [staged_keys[i] for i in with_boxes])
+
+    all_annotations = []
+    for state, p, gd_results in zip(states, prepared, all_gd_results):
+        gd_boxes = gd_results.get('boxes', torch.tensor([]))
+        if len(gd_boxes) == 0:
+            state["staged_annotations"] = []
+            all_annotations.append(None)
+            continue
+
+        geometry = segment_sam_filtered(p["staged_np"], predictor, gd_boxes, p["changed_mask"],
+                                        output_shape=p["output_shape"], image_key=p["staged_key"])
+        annotations = annotations_from_geometry(state, geometry)
+        DETECTED_OBJECTS.inc(len(annotations))
+        state["staged_annotations"] = annotations
+        all_annotations.append(annotations)
+    return all_annotations
+
+def run_batch_detection_and_populate_editors(states: list[dict], empty_imgs: list, staged_img_pils: list[Image.Image],
+                                             prompts_strs: list[str], processor, model, predictor,
+                                             max_side: int | None = MAX_INFERENCE_SIDE, roi: bool = ROI_DETECTION,
+                                             progress: Callable[[str], None] | None = None, model_client=None) -> list[tuple]:
+    """Detects objects for several empty/staged pairs at once, batching Grounding DINO and the SAM image encoder.
+
+    Diffing, detection and segmentation run on copies capped at `max_side`; masks and contours are
+    mapped back to the full-resolution staged image. With `roi`, Grounding DINO only runs on crops around
+    the changed regions, and pairs without changes skip detection entirely. `progress(stage)` is called as
+    each stage starts. With a `model_client`, Grounding DINO and SAM run on the shared model server and the
+    local models may be None. Returns one `run_detection_and_populate_editor`-style tuple per pair, in input order.
+    """
+    progress = progress or (lambda stage: None)
+    progress("diff")
+    prepared = []
+    for state, empty_img, staged_img_pil, prompts_str in zip(states, empty_imgs, staged_img_pils, prompts_strs):
+        # Decoded images (see ingest.py) are used as they are; paths are still accepted.
+        empty_img_pil = empty_img if isinstance(empty_img, Image.Image) else Image.open(empty_img)
+        if empty_img_pil.mode != "RGB":
+            empty_img_pil = empty_img_pil.convert("RGB")
+        state.update({"empty_image": empty_img_pil, "staged_image": staged_img_pil, "selected_staged": None})
+        prepared.append(prepare_detection_input(empty_img_pil, staged_img_pil, prompts_str, max_side))
+
+    if model_client is not None:
+        all_annotations = model_client.segment_prepared_inputs(states, prepared, roi=roi, progress=progress)
+    else:
+        all_annotations = segment_prepared_inputs(states, prepared, processor, model, predictor, roi=roi, progress=progress)
+
+    outputs = []
+    for state, staged_img_pil, annotations in zip(states, staged_img_pils, all_annotations):
+        if annotations is None:
+            outputs.append((staged_img_pil, "❌ No objects detected", "", {}))
+            continue
+        with span("overlay_render"):
+            staged_with_contours = draw_contours_with_selection(staged_img_pil, annotations)
+        outputs.append((staged_with_contours, f"✅ Detected {len(annotations)} objects.", get_annotations_info(state, "staged"), {}))
+    return outputs
+
+def run_detection_and_populate_editor(state: dict, empty_img, staged_img_pil: Image.Image, prompts_str, processor, model, predictor,
+                                      max_side: int | None = MAX_INFERENCE_SIDE, roi: bool = ROI_DETECTION,
+                                      progress: Callable[[str], None] | None = None, model_client=None):
+    return run_batch_detection_and_populate_editors(
+        [state], [empty_img], [staged_img_pil], [prompts_str], processor, model, predictor,
+        max_side=max_side, roi=roi, progress=progress, model_client=model_client
+    )[0]
+
+def predict_refined_mask(predictor: SamPredictor, infer_np: np.ndarray, box: np.ndarray,
+                         point_coords: np.ndarray | None = None, point_labels: np.ndarray | None = None) -> CompactMask:
+    """SAM decode of one object from prompts in inference-size coordinates, on the cached embedding when there is one."""
+    set_image_cached(predictor, infer_np)
+    masks, _, _ = predictor.predict(
+        point_coords=point_coords, point_labels=point_labels, box=box, multimask_output=False,
+    )
+    return CompactMask.from_dense(masks[0])
+
+def refine_object_mask(state: dict, obj_id: int, predictor: SamPredictor, point_coords=None, point_labels=None, box=None,
+                       model_client=None, checkpoint: Callable[[], None] | None = None) -> dict | None:
+    """Re-segments one staged object from extra point/box prompts, reusing the cached SAM embedding of the staged image.
+
+    With a `model_client` (see model_server.py) the SAM decode runs on the shared model server instead of `predictor`.
+    `checkpoint` runs after the decode and before the annotation is changed; it may raise to abandon the refinement.
+    """
+    staged_img = state.get("staged_image")
+    index = get_annotation_index(state, "staged")
+    target_annot = index.get(obj_id)
+    if staged_img is None or target_annot is None:
+        return None
+
+    # Prompts arrive in full-resolution coordinates; SAM sees the same capped copy used during detection.
+    scale = inference_scale(staged_img.size)
+    infer_np = np.array(downscale_for_inference(staged_img, scale))
+
+    if box is None:
+        x, y, w, h = target_annot['bbox']
+        box = [x, y, x + w, y + h]
+    box = np.asarray(box, dtype=np.float32) * scale
+    if point_coords is not None and len(point_coords) == 0:
+        point_coords = None
+    if point_coords is not None:
+        point_coords = np.asarray(point_coords, dtype=np.float32).reshape(-1, 2) * scale
+        point_labels = np.ones(len(point_coords), dtype=np.int32) if point_labels is None else np.asarray(point_labels, dtype=np.int32)
+    else:
+        point_labels = None
+
+    if model_client is not None:
+        mask = model_client.predict_refined_mask(infer_np, box, point_coords, point_labels)
+    else:
+        mask = predict_refined_mask(predictor, infer_np, box, point_coords, point_labels)
+    if not mask.area:
+        return None
+    x, y, _, _ = mask.bbox
+    geometry = mask_crop_to_geometry(mask.bbox_crop(), x, y, mask.shape, staged_img.size[::-1])
+    if geometry is None:
+        return None
+    mask, main_contour = geometry
+
+    if checkpoint:
+        checkpoint()
+    target_annot.update({"mask": mask, "contour": main_contour, "bbox": cv2.boundingRect(main_contour)})
+    index.update(target_annot)
+    mark_overlay_dirty(state, "staged", obj_id)
+    return target_annot
+
+def build_cutout_rgba(staged_np: np.ndarray, annot: dict) -> np.ndarray:
+    """RGBA cutout of one annotation: its bbox crop of the staged image, with the mask as alpha."""
+    x, y, w, h = annot['bbox']
+    cutout_rgba = np.zeros((h, w, 4), dtype=np.uint8)
+    cutout_rgba[:, :, :3] = staged_np[y:y+h, x:x+w]
+    cutout_rgba[:, :, 3] = annot['mask'].crop(x, y, w, h) * 255
+    return cutout_rgba
 
-def remove_background_and_add_border():
+def remove_background_and_add_border(state: dict):
     """First BG removal step: Creates a transparent image with only the detected objects and their colored contour borders."""
-    staged_img = detection_results.get("staged_image")
-    annotations = detection_results.get("staged_annotations")
+    staged_img = state.get("staged_image")
+    annotations = state.get("staged_annotations")
     if not staged_img or not annotations:
         return None, "❌ Run detection first."
     
@@ -90,7 +561,7 @@ def remove_background_and_add_border():
     
     combined_mask = np.zeros(staged_np.shape[:2], dtype=np.uint8)
     for annot in annotations:
-        combined_mask[annot['mask']] = 255
+        annot['mask'].paste_into(combined_mask, 255)
         
     rgba_image[:, :, 3] = combined_mask
     
@@ -99,6 +570,6 @@ def remove_background_and_add_border():
         cv2.drawContours(rgba_image, [annot['contour']], -1, bgr_color, 3)
 
     result_pil = Image.fromarray(rgba_image)
-    detection_results["staged_image_bg_removed"] = result_pil
+    state["staged_image_bg_removed"] = result_pil
     
     return result_pil, f"✅ Background removed for {len(annotations)} objects."
\ No newline at end of file
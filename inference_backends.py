@@ -0,0 +1,160 @@
+import os
+import time
+import numpy as np
+import torch
+from PIL import Image
+from torchvision.ops import box_iou
+
+from config import (DEVICE, INFERENCE_BACKEND, ONNX_EXPORT_DIR, ONNXRUNTIME_AVAILABLE, SAM_MODEL_TYPE,
+                    GD_BOX_THRESHOLD, GD_TEXT_THRESHOLD, PARITY_MIN_BOX_IOU, PARITY_MIN_MASK_IOU)
+
+if ONNXRUNTIME_AVAILABLE:
+    import onnxruntime as ort
+
+BACKENDS = ("eager", "quantized", "compiled", "onnx")
+
+
+class BackendParityError(Exception):
+    """Raised when an optimized backend's output drifts from eager output beyond the configured tolerance."""
+
+
+class OnnxImageEncoder(torch.nn.Module):
+    """Drop-in replacement for SAM's image encoder that runs an exported ONNX Runtime graph."""
+
+    def __init__(self, onnx_path: str, img_size: int):
+        super().__init__()
+        self.img_size = img_size
+        self.session = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        # Exported with a fixed batch of one; batched encoder calls are split.
+        outputs = [self.session.run(None, {"image": x[i:i + 1].cpu().numpy()})[0] for i in range(len(x))]
+        return torch.from_numpy(np.concatenate(outputs)).to(x.device)
+
+
+def export_sam_image_encoder(image_encoder: torch.nn.Module, onnx_path: str) -> None:
+    os.makedirs(os.path.dirname(onnx_path) or ".", exist_ok=True)
+    dummy = torch.zeros(1, 3, image_encoder.img_size, image_encoder.img_size, device=next(image_encoder.parameters()).device)
+    with torch.no_grad():
+        torch.onnx.export(
+            image_encoder, (dummy,), onnx_path,
+            input_names=["image"], output_names=["embeddings"], opset_version=17, dynamo=False,
+        )
+
+
+def apply_backend(processor, model, predictor, backend: str = INFERENCE_BACKEND):
+    """Converts freshly loaded eager models to `backend` in place and returns them.
+
+    "onnx" only covers the SAM image encoder (the dominant CPU cost); Grounding DINO stays eager
+    because its text-conditioned graph does not export cleanly.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend}'. Choose one of {BACKENDS}.")
+    if backend == "eager":
+        return processor, model, predictor
+    if DEVICE.type != "cpu" and backend in ("quantized", "onnx"):
+        print(f"WARNING: '{backend}' backend is CPU-only; using eager on {DEVICE}.")
+        return processor, model, predictor
+
+    sam = predictor.model
+    if backend == "quantized":
+        torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        torch.ao.quantization.quantize_dynamic(sam.image_encoder, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    elif backend == "compiled":
+        # Wrapping `forward` keeps the modules' attributes (config, img_size, ...) reachable as before.
+        model.forward = torch.compile(model.forward)
+        sam.image_encoder.forward = torch.compile(sam.image_encoder.forward)
+    elif backend == "onnx":
+        if not ONNXRUNTIME_AVAILABLE:
+            print("WARNING: onnxruntime not found. Falling back to the eager backend.")
+            return processor, model, predictor
+        onnx_path = os.path.join(ONNX_EXPORT_DIR, f"sam_{SAM_MODEL_TYPE}_image_encoder.onnx")
+        if not os.path.exists(onnx_path):
+            print(f"Exporting SAM image encoder to {onnx_path} (one-time)...")
+            export_sam_image_encoder(sam.image_encoder, onnx_path)
+        sam.image_encoder = OnnxImageEncoder(onnx_path, sam.image_encoder.img_size)
+
+    print(f"Inference backend '{backend}' applied.")
+    return processor, model, predictor
+
+
+def run_probe(processor, model, predictor, image_pil: Image.Image, text_prompt: str) -> dict:
+    """Runs Grounding DINO then SAM on one image, bypassing all caches, and returns outputs with stage timings."""
+    image_pil = image_pil.convert("RGB")
+    start = time.perf_counter()
+    inputs = processor(images=image_pil, text=text_prompt, return_tensors="pt").to(DEVICE)
+    with torch.no_grad():
+        outputs = model(**inputs)
+    gd_results = processor.post_process_grounded_object_detection(
+        outputs, inputs.input_ids, threshold=GD_BOX_THRESHOLD, text_threshold=GD_TEXT_THRESHOLD,
+        target_sizes=[image_pil.size[::-1]]
+    )[0]
+    gd_seconds = time.perf_counter() - start
+
+    image_np = np.array(image_pil)
+    start = time.perf_counter()
+    predictor.set_image(image_np)
+    encode_seconds = time.perf_counter() - start
+    return {
+        "boxes": gd_results["boxes"].detach().cpu().float(),
+        "gd_seconds": gd_seconds,
+        "sam_encode_seconds": encode_seconds,
+        "image_np": image_np,
+    }
+
+
+def decode_masks(predictor, image_np: np.ndarray, boxes: torch.Tensor) -> torch.Tensor:
+    """SAM masks for `boxes` from the predictor's current image embedding, as a `[N,H,W]` bool CPU tensor."""
+    if len(boxes) == 0:
+        return torch.zeros((0, *image_np.shape[:2]), dtype=torch.bool)
+    transformed = predictor.transform.apply_boxes_torch(boxes.to(DEVICE), image_np.shape[:2])
+    with torch.no_grad():
+        masks, _, _ = predictor.predict_torch(point_coords=None, point_labels=None, boxes=transformed, multimask_output=False)
+    return masks[:, 0].cpu()
+
+
+def mean_box_iou(reference: torch.Tensor, candidate: torch.Tensor) -> float:
+    """Mean over reference boxes of the best IoU with any candidate box (1.0 when both are empty)."""
+    if len(reference) == 0 and len(candidate) == 0:
+        return 1.0
+    if len(reference) == 0 or len(candidate) == 0:
+        return 0.0
+    return box_iou(reference, candidate).max(dim=1).values.mean().item()
+
+
+def mean_mask_iou(reference: torch.Tensor, candidate: torch.Tensor) -> float:
+    """Mean IoU of index-aligned `[N,H,W]` bool masks (1.0 when there are none)."""
+    if len(reference) == 0:
+        return 1.0
+    intersection = (reference & candidate).flatten(1).sum(dim=1).double()
+    union = (reference | candidate).flatten(1).sum(dim=1).double().clamp(min=1)
+    return (intersection / union).mean().item()
+
+
+def check_parity(reference: dict, candidate: dict, reference_masks: torch.Tensor, candidate_masks: torch.Tensor,
+                 min_box_iou: float = PARITY_MIN_BOX_IOU, min_mask_iou: float = PARITY_MIN_MASK_IOU) -> dict:
+    """Compares backend output to eager output. Masks must be decoded from the same (eager) boxes on both sides."""
+    box_score = mean_box_iou(reference["boxes"], candidate["boxes"])
+    mask_score = mean_mask_iou(reference_masks, candidate_masks)
+    return {
+        "box_iou": round(box_score, 4),
+        "mask_iou": round(mask_score, 4),
+        "passed": box_score >= min_box_iou and mask_score >= min_mask_iou,
+    }
+
+
+def apply_backend_checked(processor, model, predictor, backend: str, probe_image_path: str, text_prompt: str):
+    """Applies `backend`, raising BackendParityError if it drifts from eager output on the probe image."""
+    probe_image = Image.open(probe_image_path)
+    reference = run_probe(processor, model, predictor, probe_image, text_prompt)
+    reference_masks = decode_masks(predictor, reference["image_np"], reference["boxes"])
+
+    processor, model, predictor = apply_backend(processor, model, predictor, backend)
+    candidate = run_probe(processor, model, predictor, probe_image, text_prompt)
+    candidate_masks = decode_masks(predictor, candidate["image_np"], reference["boxes"])
+
+    report = check_parity(reference, candidate, reference_masks, candidate_masks)
+    print(f"Backend '{backend}' parity vs eager: box IoU {report['box_iou']}, mask IoU {report['mask_iou']}")
+    if not report["passed"]:
+        raise BackendParityError(f"Backend '{backend}' failed the parity check: {report}")
+    return processor, model, predictor
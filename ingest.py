@@ -0,0 +1,43 @@
+import io
+
+from PIL import Image
+
+from telemetry import span
+
+
+def read_upload(file_storage) -> bytes:
+    """Reads an uploaded file into memory (bounded by the request size limits in app.py); empty when no file was sent."""
+    if not file_storage:
+        return b""
+    return file_storage.stream.read()
+
+
+def decode_image(source, target_size: tuple[int, int] | None = None) -> Image.Image:
+    """Decodes encoded bytes or a path to RGB exactly once, optionally resized to `target_size`.
+
+    When the target is smaller than a JPEG on both axes, the decoder is asked for a reduced DCT scale (1/2, 1/4
+    or 1/8, never below the target), so the full-resolution frame is never materialised before the resize.
+    """
+    image = Image.open(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+    if target_size and image.format == "JPEG" and image.width > target_size[0] and image.height > target_size[1]:
+        image.draft("RGB", target_size)
+    image.load()
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if target_size and image.size != tuple(target_size):
+        image = image.resize(target_size)
+    return image
+
+
+def ingest_pair(empty_file, staged_file, assets) -> tuple[Image.Image, Image.Image, str]:
+    """Decodes an empty/staged upload pair straight from the request, the staged photo at the empty room's size.
+
+    Only the empty room is served back to the editor, so only its original is stored, in the background.
+    Returns `(empty_img_pil, staged_img_pil, empty_url)`; raises OSError for unreadable images.
+    """
+    empty_bytes, staged_bytes = read_upload(empty_file), read_upload(staged_file)
+    with span("image_decode"):
+        empty_img_pil = decode_image(empty_bytes)
+        staged_img_pil = decode_image(staged_bytes, empty_img_pil.size)
+    _, empty_url, _ = assets.put_upload_async(empty_bytes, empty_file.filename)
+    return empty_img_pil, staged_img_pil, empty_url
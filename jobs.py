@@ -0,0 +1,210 @@
+import contextvars
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from config import INFERENCE_QUEUE_MAX_DEPTH, NETWORK_JOB_MAX_CONCURRENCY, NETWORK_QUEUE_MAX_DEPTH, JOB_RESULT_TTL_SECONDS
+from telemetry import STAGE_SECONDS, log_event
+
+# Jobs that touch the shared models (the SAM predictor is stateful through set_image) run one at a time.
+INFERENCE = "inference"
+# Network-bound jobs (remote Gemini calls) run concurrently on a small pool.
+NETWORK = "network"
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while its queue is at capacity."""
+
+
+class JobFailed(Exception):
+    """Raised by job functions to fail with a user-facing message."""
+
+
+class JobCancelled(Exception):
+    """Raised inside a job function once cancellation has been requested."""
+
+
+class Job:
+    def __init__(self, kind: str, fn: Callable, args: tuple, kwargs: dict):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = threading.Event()
+        self.done = threading.Event()
+        # Set for network jobs, so a job still waiting for a pool thread can be cancelled without running.
+        self.future = None
+        # Progress events for `/jobs/<id>/events`, in emit order; a client resumes by list position.
+        self.events: list[tuple[str, dict]] = []
+        self._events_changed = threading.Condition()
+        # Runs in the submitting request's context, so spans and logs keep its request id.
+        self.context = contextvars.copy_context()
+
+    def raise_if_cancelled(self) -> None:
+        """Checkpoint for job functions between stages; cancellation is cooperative once a job is running."""
+        if self.cancel_requested.is_set():
+            raise JobCancelled()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self.done.wait(timeout)
+
+    def emit(self, event: str, data: dict | None = None) -> None:
+        """Publishes a progress event (a stage change, a finished object) to the job's event stream."""
+        with self._events_changed:
+            self.events.append((event, data or {}))
+            self._events_changed.notify_all()
+
+    def events_after(self, position: int, timeout: float | None = None) -> list[tuple[str, dict]]:
+        """Events from `position` on, blocking up to `timeout` until there is one or the job has finished."""
+        with self._events_changed:
+            self._events_changed.wait_for(lambda: len(self.events) > position or self.done.is_set(), timeout)
+            return self.events[position:]
+
+    def finish(self) -> None:
+        with self._events_changed:
+            self.done.set()
+            self._events_changed.notify_all()
+
+    def to_dict(self) -> dict:
+        data = {'job_id': self.id, 'kind': self.kind, 'status': self.status}
+        if self.status == "done":
+            data['result'] = self.result
+        elif self.status == "failed":
+            data['error'] = self.error
+        if self.started_at:
+            data['queued_seconds'] = round(self.started_at - self.created_at, 3)
+        if self.finished_at and self.started_at:
+            data['run_seconds'] = round(self.finished_at - self.started_at, 3)
+        return data
+
+
+class JobScheduler:
+    """Runs inference jobs on a single worker thread and network jobs on a bounded pool, with per-queue depth limits."""
+
+    def __init__(self, inference_max_depth: int = INFERENCE_QUEUE_MAX_DEPTH,
+                 network_max_concurrency: int = NETWORK_JOB_MAX_CONCURRENCY,
+                 network_max_depth: int = NETWORK_QUEUE_MAX_DEPTH,
+                 result_ttl_seconds: float = JOB_RESULT_TTL_SECONDS):
+        self.network_max_depth = network_max_depth
+        self.result_ttl_seconds = result_ttl_seconds
+        self._jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._inference_queue: queue.Queue[Job] = queue.Queue(maxsize=inference_max_depth)
+        self._network_pool = ThreadPoolExecutor(max_workers=network_max_concurrency, thread_name_prefix="network-job")
+        self._network_pending = 0
+        self._inference_worker = threading.Thread(target=self._inference_loop, name="inference-worker", daemon=True)
+        self._inference_worker.start()
+
+    def submit(self, kind: str, fn: Callable, *args, **kwargs) -> Job:
+        """Queues `fn(job, *args, **kwargs)` and returns the job; raises QueueFullError if the queue is at capacity."""
+        job = Job(kind, fn, args, kwargs)
+        self._prune()
+        if kind == INFERENCE:
+            try:
+                self._inference_queue.put_nowait(job)
+            except queue.Full:
+                raise QueueFullError("The inference queue is full. Please retry shortly.")
+        elif kind == NETWORK:
+            with self._lock:
+                if self._network_pending >= self.network_max_depth:
+                    raise QueueFullError("Too many AI edits are in progress. Please retry shortly.")
+                self._network_pending += 1
+            job.future = self._network_pool.submit(self._run_network, job)
+        else:
+            raise ValueError(f"Unknown job kind: {kind}")
+        with self._lock:
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancels a queued job outright, freeing its queue slot, or asks a running job to stop at its next checkpoint."""
+        job = self.get(job_id)
+        if job is None or job.done.is_set():
+            return False
+        job.cancel_requested.set()
+        with self._lock:
+            if job.status != "queued":
+                return True
+            job.status = "cancelled"
+            if job.kind == INFERENCE:
+                self._remove_queued(job)
+            elif job.future.cancel():
+                self._network_pending -= 1
+        self._finish(job)
+        return True
+
+    def _remove_queued(self, job: Job) -> None:
+        q = self._inference_queue
+        with q.mutex:
+            try:
+                q.queue.remove(job)
+            except ValueError:
+                return  # Already dequeued; the worker skips it because it is no longer "queued".
+            q.unfinished_tasks -= 1
+            q.not_full.notify()
+
+    def queue_depths(self) -> dict[str, int]:
+        with self._lock:
+            return {INFERENCE: self._inference_queue.qsize(), NETWORK: self._network_pending}
+
+    def _inference_loop(self) -> None:
+        while True:
+            job = self._inference_queue.get()
+            try:
+                self._run(job)
+            finally:
+                self._inference_queue.task_done()
+
+    def _run_network(self, job: Job) -> None:
+        try:
+            self._run(job)
+        finally:
+            with self._lock:
+                self._network_pending -= 1
+
+    def _run(self, job: Job) -> None:
+        with self._lock:
+            if job.status != "queued":
+                return  # Cancelled while queued; cancel() has already finished it.
+            job.status = "running"
+        job.started_at = time.time()
+        STAGE_SECONDS.observe(job.started_at - job.created_at, stage=f"{job.kind}_queue_wait")
+        try:
+            job.result = job.context.run(job.fn, job, *job.args, **job.kwargs)
+            job.status = "done"
+        except JobCancelled:
+            job.status = "cancelled"
+        except JobFailed as e:
+            job.status, job.error = "failed", str(e)
+        except Exception as e:
+            job.status, job.error = "failed", f"{type(e).__name__}: {e}"
+        self._finish(job)
+
+    def _finish(self, job: Job) -> None:
+        job.finished_at = time.time()
+        job.context.run(log_event, "job", job_id=job.id, kind=job.kind, status=job.status, error=job.error,
+                        seconds=round(job.finished_at - (job.started_at or job.finished_at), 4))
+        # Drop references to inputs (images, request data) as soon as the job is finished.
+        job.fn, job.args, job.kwargs = None, (), {}
+        job.finish()
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.result_ttl_seconds
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items() if job.finished_at and job.finished_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
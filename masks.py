@@ -0,0 +1,86 @@
+import numpy as np
+
+
+class CompactMask:
+    """Immutable boolean mask stored as a bit-packed crop of its tight bounding box.
+
+    Behaves like the full-frame boolean array it replaces for the accesses the editor needs:
+    `mask[y0:y1, x0:x1]` slicing, `area`, `shape` and `to_dense()`. Copies share the packed data.
+    """
+
+    __slots__ = ("shape", "bbox", "area", "_packed")
+
+    def __init__(self, shape: tuple[int, int], bbox: tuple[int, int, int, int], packed: np.ndarray, area: int):
+        self.shape = shape
+        self.bbox = bbox
+        self.area = area
+        self._packed = packed
+        self._packed.flags.writeable = False
+
+    @classmethod
+    def from_dense(cls, mask: np.ndarray) -> "CompactMask":
+        mask = np.asarray(mask, dtype=bool)
+        return cls.from_crop(mask.shape, 0, 0, mask)
+
+    @classmethod
+    def from_crop(cls, shape: tuple[int, int], x: int, y: int, crop: np.ndarray) -> "CompactMask":
+        """Builds a mask from a crop whose top-left corner sits at (x, y) in a frame of `shape`; the crop is tightened first."""
+        crop = np.asarray(crop, dtype=bool)
+        rows = np.flatnonzero(crop.any(axis=1))
+        if rows.size == 0:
+            return cls(tuple(shape[:2]), (0, 0, 0, 0), np.zeros(0, dtype=np.uint8), 0)
+        cols = np.flatnonzero(crop.any(axis=0))
+        y0, y1, x0, x1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        tight = crop[y0:y1, x0:x1]
+        bbox = (int(x + x0), int(y + y0), int(x1 - x0), int(y1 - y0))
+        return cls(tuple(shape[:2]), bbox, np.packbits(tight, axis=None), int(np.count_nonzero(tight)))
+
+    @property
+    def nbytes(self) -> int:
+        return self._packed.nbytes
+
+    def bbox_crop(self) -> np.ndarray:
+        """Returns the boolean pixels inside `bbox` only."""
+        _, _, w, h = self.bbox
+        return np.unpackbits(self._packed, count=w * h).reshape(h, w).view(bool)
+
+    def crop(self, x: int, y: int, w: int, h: int) -> np.ndarray:
+        """Returns the mask over an arbitrary full-frame region, zero outside the stored bounding box."""
+        out = np.zeros((max(h, 0), max(w, 0)), dtype=bool)
+        bx, by, bw, bh = self.bbox
+        ix0, iy0 = max(x, bx), max(y, by)
+        ix1, iy1 = min(x + w, bx + bw), min(y + h, by + bh)
+        if ix0 < ix1 and iy0 < iy1:
+            out[iy0 - y:iy1 - y, ix0 - x:ix1 - x] = self.bbox_crop()[iy0 - by:iy1 - by, ix0 - bx:ix1 - bx]
+        return out
+
+    def to_dense(self) -> np.ndarray:
+        height, width = self.shape
+        return self.crop(0, 0, width, height)
+
+    def paste_into(self, canvas: np.ndarray, value) -> None:
+        """Sets `canvas[mask] = value` touching only the bounding-box region of `canvas`."""
+        x, y, w, h = self.bbox
+        if w and h:
+            canvas[y:y + h, x:x + w][self.bbox_crop()] = value
+
+    def copy(self) -> "CompactMask":
+        # Immutable, so sharing the packed buffer is safe.
+        return self
+
+    def __getitem__(self, key) -> np.ndarray:
+        if not (isinstance(key, tuple) and len(key) == 2 and all(isinstance(k, slice) for k in key)):
+            return self.to_dense()[key]
+        height, width = self.shape
+        y0, y1, _ = key[0].indices(height)
+        x0, x1, _ = key[1].indices(width)
+        if key[0].step not in (None, 1) or key[1].step not in (None, 1):
+            return self.to_dense()[key]
+        return self.crop(x0, y0, x1 - x0, y1 - y0)
+
+    def __array__(self, dtype=None, copy=None):
+        dense = self.to_dense()
+        return dense if dtype is None else dense.astype(dtype)
+
+    def __repr__(self) -> str:
+        return f"CompactMask(shape={self.shape}, bbox={self.bbox}, area={self.area})"
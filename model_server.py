@@ -0,0 +1,264 @@
+"""Model server: one process owns Grounding DINO and SAM and serves every web worker over a Unix socket.
+
+Web workers keep decoding, diffing and all file I/O; they send the inference-size inputs here and get
+annotations back, so the models are loaded (and their memory paid) once however many workers run.
+
+Both sides must share a secret in MODEL_SERVER_AUTHKEY; the server unpickles its input, so the key (and the
+socket's owner-only permissions) are what keep other local users out.
+
+Usage:
+    export MODEL_SERVER_AUTHKEY=$(python -c "import secrets; print(secrets.token_hex(32))")
+    python model_server.py --address /tmp/faststager-models.sock
+    MODEL_SERVER_ADDRESS=/tmp/faststager-models.sock python app.py
+"""
+import argparse
+import os
+import queue
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+from PIL import Image
+
+from config import GD_BATCH_SIZE, MODEL_SERVER_AUTHKEY, MODEL_SERVER_BATCH_WAIT_SECONDS, ROI_DETECTION
+from image_processing import gd_result_cache, sam_embedding_cache, segment_prepared_inputs, predict_refined_mask
+from masks import CompactMask
+from models import start_background_loading, get_models, model_status
+
+
+class ModelServerError(Exception):
+    """Raised by ModelClient when the model server is unreachable or a request failed there."""
+
+
+def _require_authkey(authkey: bytes) -> bytes:
+    if not authkey:
+        raise ModelServerError("MODEL_SERVER_AUTHKEY is not set; give the model server and every web worker the same secret.")
+    return authkey
+
+
+class _Request:
+    def __init__(self, op: str, payload: dict):
+        self.op = op
+        self.payload = payload
+        self.reply = None
+        self.done = threading.Event()
+
+
+class ModelServer:
+    """Accepts web-worker connections and runs their requests one at a time on a single inference thread.
+
+    Detection requests that arrive within `batch_wait` seconds of each other are merged into one batched
+    Grounding DINO/SAM pass of up to `batch_size` image pairs. Stats requests are answered immediately.
+    """
+
+    def __init__(self, address: str, authkey: bytes = MODEL_SERVER_AUTHKEY, batch_size: int = GD_BATCH_SIZE,
+                 batch_wait: float = MODEL_SERVER_BATCH_WAIT_SECONDS):
+        self.address = address
+        self.authkey = _require_authkey(authkey)
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self._queue: queue.Queue[_Request] = queue.Queue()
+
+    def serve_forever(self) -> None:
+        start_background_loading()
+        threading.Thread(target=self._inference_loop, name="model-server-inference", daemon=True).start()
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        with Listener(self.address, family="AF_UNIX", authkey=self.authkey) as listener:
+            os.chmod(self.address, 0o600)
+            print(f"Model server listening on {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    print(f"Model server rejected a connection: {e}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), name="model-server-conn", daemon=True).start()
+
+    def _handle(self, conn) -> None:
+        with conn:
+            while True:
+                try:
+                    op, payload = conn.recv()
+                except (EOFError, OSError):
+                    return
+                if op == "stats":
+                    reply = ("ok", {"status": model_status(),
+                                    "caches": {"gd_result": gd_result_cache.stats(),
+                                               "sam_embedding": sam_embedding_cache.stats()}})
+                else:
+                    request = _Request(op, payload)
+                    self._queue.put(request)
+                    request.done.wait()
+                    reply = request.reply
+                try:
+                    conn.send(reply)
+                except OSError:
+                    return
+
+    def _inference_loop(self) -> None:
+        held = None
+        while True:
+            request, held = held or self._queue.get(), None
+            batch = [request]
+            if request.op == "segment":
+                pairs = len(request.payload["prepared"])
+                deadline = time.monotonic() + self.batch_wait
+                while pairs < self.batch_size:
+                    try:
+                        other = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                    if other.op != "segment" or other.payload["roi"] != request.payload["roi"]:
+                        held = other
+                        break
+                    batch.append(other)
+                    pairs += len(other.payload["prepared"])
+            self._run(batch)
+
+    def _run(self, batch: list[_Request]) -> None:
+        try:
+            processor, model, predictor = get_models()
+            if batch[0].op == "segment":
+                self._segment(batch, processor, model, predictor)
+            elif batch[0].op == "refine":
+                batch[0].reply = ("ok", predict_refined_mask(predictor, **batch[0].payload))
+            else:
+                batch[0].reply = ("error", f"Unknown model server request '{batch[0].op}'.")
+        except Exception as e:
+            for request in batch:
+                request.reply = ("error", f"{type(e).__name__}: {e}")
+        finally:
+            for request in batch:
+                request.done.set()
+
+    def _segment(self, batch: list[_Request], processor, model, predictor) -> None:
+        states, prepared = [], []
+        for request in batch:
+            for p, next_id in zip(request.payload["prepared"], request.payload["next_ids"]):
+                states.append({"next_id": next_id})
+                # The client leaves out the PIL copy of `staged_np` to halve the bytes on the socket.
+                prepared.append({**p, "infer_pil": Image.fromarray(p["staged_np"])})
+        all_annotations = segment_prepared_inputs(states, prepared, processor, model, predictor,
+                                                  roi=batch[0].payload["roi"])
+        start = 0
+        for request in batch:
+            end = start + len(request.payload["prepared"])
+            request.reply = ("ok", [(annotations, state["next_id"])
+                                    for annotations, state in zip(all_annotations[start:end], states[start:end])])
+            start = end
+
+
+class ModelClient:
+    """A web worker's connection to the model server, standing in for the in-process model half of the pipeline.
+
+    One connection per process, used by one request at a time (the job scheduler already serializes inference).
+    A dropped connection is re-opened once per request, so the server can be restarted under running workers.
+    """
+
+    def __init__(self, address: str, authkey: bytes = MODEL_SERVER_AUTHKEY, stats_ttl: float = 1.0):
+        self.address = address
+        self.authkey = _require_authkey(authkey)
+        self.stats_ttl = stats_ttl
+        self._conn = None
+        self._lock = threading.Lock()
+        self._stats: tuple[float, dict | None] = (0.0, None)
+
+    def _connect(self):
+        return Client(self.address, family="AF_UNIX", authkey=self.authkey)
+
+    def _request(self, op: str, payload: dict):
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._conn is None:
+                        self._conn = self._connect()
+                    self._conn.send((op, payload))
+                    status, result = self._conn.recv()
+                    break
+                except (OSError, EOFError) as e:
+                    if self._conn is not None:
+                        self._conn.close()
+                        self._conn = None
+                    if attempt:
+                        raise ModelServerError(f"Model server at {self.address} is unreachable: {e}")
+        if status != "ok":
+            raise ModelServerError(result)
+        return result
+
+    def segment_prepared_inputs(self, states: list[dict], prepared: list[dict], roi: bool = ROI_DETECTION,
+                                progress=None) -> list[list[dict] | None]:
+        """Remote `image_processing.segment_prepared_inputs`; annotation ids continue from each state's `next_id`."""
+        if progress:
+            progress("grounding_dino")
+        results = self._request("segment", {
+            "prepared": [{k: v for k, v in p.items() if k != "infer_pil"} for p in prepared],
+            "next_ids": [state["next_id"] for state in states],
+            "roi": roi,
+        })
+        all_annotations = []
+        for state, (annotations, next_id) in zip(states, results):
+            state["staged_annotations"] = annotations or []
+            state["next_id"] = next_id
+            all_annotations.append(annotations)
+        return all_annotations
+
+    def predict_refined_mask(self, infer_np: np.ndarray, box: np.ndarray, point_coords: np.ndarray | None = None,
+                             point_labels: np.ndarray | None = None) -> CompactMask:
+        return self._request("refine", {"infer_np": infer_np, "box": box,
+                                        "point_coords": point_coords, "point_labels": point_labels})
+
+    def _server_stats(self) -> dict:
+        """Status and cache stats from one request, reused for `stats_ttl` seconds so a /metrics scrape costs one round trip."""
+        fetched_at, stats = self._stats
+        now = time.monotonic()
+        if stats is None or now - fetched_at > self.stats_ttl:
+            try:
+                # A short-lived connection of its own, so stats never wait behind inference.
+                with self._connect() as conn:
+                    conn.send(("stats", None))
+                    _, stats = conn.recv()
+            except Exception as e:
+                stats = {"status": {'ready': False, 'loading': False, 'error': f"Model server unreachable: {e}"},
+                         "caches": {}}
+            self._stats = (now, stats)
+        return stats
+
+    def status(self) -> dict:
+        """The server's `model_status()`, or a not-ready status when it cannot be reached."""
+        return self._server_stats()["status"]
+
+    def cache_stats(self) -> dict[str, dict]:
+        """`stats()` of the server's Grounding DINO and SAM embedding caches by name; empty when it cannot be reached."""
+        return self._server_stats()["caches"]
+
+
+class RemoteCacheStats:
+    """Stands in for one of the model server's caches in `telemetry.cache_collector`."""
+
+    def __init__(self, client: ModelClient, name: str):
+        self.client = client
+        self.name = name
+
+    def stats(self) -> dict:
+        return self.client.cache_stats().get(self.name, {})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--address", default=os.environ.get("MODEL_SERVER_ADDRESS", "/tmp/faststager-models.sock"),
+                        help="Unix socket path to listen on.")
+    parser.add_argument("--batch-size", type=int, default=GD_BATCH_SIZE, help="Most image pairs merged into one pass.")
+    parser.add_argument("--batch-wait", type=float, default=MODEL_SERVER_BATCH_WAIT_SECONDS,
+                        help="Seconds to wait for more detection requests to batch with the first.")
+    args = parser.parse_args()
+    try:
+        server = ModelServer(args.address, batch_size=args.batch_size, batch_wait=args.batch_wait)
+    except ModelServerError as e:
+        parser.error(str(e))
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,102 @@
 import os
+import threading
+import time
 import torch
 from transformers import AutoProcessor, AutoModelForZeroShotObjectDetection
-from segment_anything import build_sam, SamPredictor
-from config import DEVICE, HF_GD_MODEL_ID, SAM_CHECKPOINT_PATH
+from segment_anything import sam_model_registry, SamPredictor
+from config import (DEVICE, HF_GD_MODEL_ID, SAM_MODEL_TYPE, SAM_CHECKPOINT_PATH, MODELS_LOCAL_FILES_ONLY,
+                    INFERENCE_BACKEND, PARITY_PROBE_IMAGE, PARITY_PROBE_PROMPT)
+from inference_backends import apply_backend, apply_backend_checked, BackendParityError
 
-def load_models():
-    """Loads and initializes all required AI models."""
+_models = None
+_load_error = None
+_load_seconds = None
+_ready = threading.Event()
+_loader_lock = threading.Lock()
+_loader_thread = None
+
+
+class ModelsNotReady(Exception):
+    """Raised when models are requested before background loading has finished."""
+
+
+def load_eager_models():
+    """Loads all required AI models as plain fp32 PyTorch modules."""
     print("\n--- Loading Models ---")
 
-    hf_gd_processor = AutoProcessor.from_pretrained(HF_GD_MODEL_ID)
-    hf_gd_model = AutoModelForZeroShotObjectDetection.from_pretrained(HF_GD_MODEL_ID).to(DEVICE)
+    hf_gd_processor = AutoProcessor.from_pretrained(HF_GD_MODEL_ID, local_files_only=MODELS_LOCAL_FILES_ONLY)
+    hf_gd_model = AutoModelForZeroShotObjectDetection.from_pretrained(
+        HF_GD_MODEL_ID, local_files_only=MODELS_LOCAL_FILES_ONLY
+    ).to(DEVICE)
     hf_gd_model.eval()
     print(f"Hugging Face Grounding DINO model '{HF_GD_MODEL_ID}' loaded.")
 
     if not os.path.exists(SAM_CHECKPOINT_PATH):
-        print(f"SAM checkpoint '{SAM_CHECKPOINT_PATH}' not found. Downloading...")
-        os.system(f"wget https://dl.fbaipublicfiles.com/segment_anything/sam_vit_h_4b8939.pth -O {SAM_CHECKPOINT_PATH}")
-        print("SAM checkpoint downloaded.")
-    sam_predictor = SamPredictor(build_sam(checkpoint=SAM_CHECKPOINT_PATH).to(DEVICE))
-    print(f"SAM Predictor model loaded from {SAM_CHECKPOINT_PATH}")
+        raise FileNotFoundError(
+            f"SAM checkpoint '{SAM_CHECKPOINT_PATH}' for '{SAM_MODEL_TYPE}' not found. "
+            f"Download it from https://dl.fbaipublicfiles.com/segment_anything/{os.path.basename(SAM_CHECKPOINT_PATH)} "
+            "or set SAM_CHECKPOINT_PATH."
+        )
+    sam_predictor = SamPredictor(sam_model_registry[SAM_MODEL_TYPE](checkpoint=SAM_CHECKPOINT_PATH).to(DEVICE))
+    print(f"SAM Predictor model '{SAM_MODEL_TYPE}' loaded from {SAM_CHECKPOINT_PATH}")
 
     print("--- Models Loaded ---")
-    return hf_gd_processor, hf_gd_model, sam_predictor
\ No newline at end of file
+    return hf_gd_processor, hf_gd_model, sam_predictor
+
+
+def load_models():
+    """Loads and initializes all required AI models on the configured inference backend."""
+    models = load_eager_models()
+    if INFERENCE_BACKEND == "eager":
+        return models
+    if not PARITY_PROBE_IMAGE:
+        return apply_backend(*models, INFERENCE_BACKEND)
+    try:
+        return apply_backend_checked(*models, INFERENCE_BACKEND, PARITY_PROBE_IMAGE, PARITY_PROBE_PROMPT)
+    except BackendParityError as e:
+        print(f"WARNING: {e}. Reloading eager models.")
+        return load_eager_models()
+
+
+def _load_in_background():
+    global _models, _load_error, _load_seconds
+    start = time.time()
+    try:
+        _models = load_models()
+    except Exception as e:
+        _load_error = f"{type(e).__name__}: {e}"
+        print(f"🚨 ERROR: Model loading failed: {_load_error}")
+    _load_seconds = time.time() - start
+    _ready.set()
+
+
+def start_background_loading() -> None:
+    """Starts loading models on a daemon thread so the web server can answer requests immediately."""
+    global _loader_thread
+    with _loader_lock:
+        if _loader_thread is None:
+            _loader_thread = threading.Thread(target=_load_in_background, name="model-loader", daemon=True)
+            _loader_thread.start()
+
+
+def get_models(timeout: float | None = None):
+    """Returns `(processor, model, predictor)`, starting the loader if needed and waiting up to `timeout` seconds."""
+    start_background_loading()
+    if not _ready.wait(timeout):
+        raise ModelsNotReady("Models are still loading. Please retry shortly.")
+    if _load_error:
+        raise ModelsNotReady(f"Models failed to load: {_load_error}")
+    return _models
+
+
+def model_status() -> dict:
+    return {
+        'ready': _ready.is_set() and _load_error is None,
+        'loading': _loader_thread is not None and not _ready.is_set(),
+        'error': _load_error,
+        'load_seconds': round(_load_seconds, 2) if _load_seconds is not None else None,
+        'device': str(DEVICE),
+        'gd_model': HF_GD_MODEL_ID,
+        'sam_model_type': SAM_MODEL_TYPE,
+        'inference_backend': INFERENCE_BACKEND,
+    }
@@ -0,0 +1,111 @@
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from config import SESSION_MEMORY_BUDGET_BYTES, SESSION_MAX_COUNT
+
+
+def new_session_state() -> dict[str, object]:
+    """Returns a fresh editor state, one per user session."""
+    return {
+        "staged_annotations": [],
+        "empty_annotations": [],
+        "staged_index": None,
+        "empty_index": None,
+        "staged_overlay": None,
+        "empty_overlay": None,
+        "staged_image": None,
+        "empty_image": None,
+        "staged_image_bg_removed": None,
+        "selected_staged": None,
+        "selected_empty": None,
+        "next_id": 1,
+        "generated_images": [],
+        "original_cutouts_by_id": {},
+        "cutout_images_by_id": {}
+    }
+
+
+def estimate_state_bytes(value) -> int:
+    """Roughly estimates the memory held by images, arrays and containers inside a session state."""
+    if value is None:
+        return 0
+    if isinstance(value, Image.Image):
+        return value.width * value.height * len(value.getbands())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sum(estimate_state_bytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_state_bytes(v) for v in value)
+    return 0
+
+
+class SessionStore:
+    """Thread-safe map of session token -> editor state with LRU eviction under a memory budget."""
+
+    def __init__(self, max_bytes: int = SESSION_MEMORY_BUDGET_BYTES, max_sessions: int = SESSION_MAX_COUNT):
+        self.max_bytes = max_bytes
+        self.max_sessions = max_sessions
+        self._sessions: OrderedDict[str, dict] = OrderedDict()
+        self._sizes: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def create(self) -> tuple[str, dict]:
+        session_id = uuid.uuid4().hex
+        state = new_session_state()
+        with self._lock:
+            self._sessions[session_id] = state
+            self._sizes[session_id] = 0
+            self._evict(keep=session_id)
+        return session_id, state
+
+    def get(self, session_id: str | None) -> dict | None:
+        if not session_id:
+            return None
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is not None:
+                self._sessions.move_to_end(session_id)
+            return state
+
+    def get_or_create(self, session_id: str | None) -> tuple[str, dict]:
+        state = self.get(session_id)
+        if state is not None:
+            return session_id, state
+        return self.create()
+
+    def commit(self, session_id: str) -> None:
+        """Re-measures a session after it was mutated and evicts idle sessions if over budget."""
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is None:
+                return
+            self._sizes[session_id] = estimate_state_bytes(state)
+            self._sessions.move_to_end(session_id)
+            self._evict(keep=session_id)
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def _evict(self, keep: str) -> None:
+        # Oldest entries sit at the front of the OrderedDict; the session being served is never evicted.
+        total = sum(self._sizes.values())
+        for session_id in list(self._sessions):
+            if total <= self.max_bytes and len(self._sessions) <= self.max_sessions:
+                break
+            if session_id == keep:
+                continue
+            del self._sessions[session_id]
+            total -= self._sizes.pop(session_id, 0)
+            print(f"Evicted idle session {session_id[:8]} to stay within the session memory budget.")
@@ -0,0 +1,199 @@
+import contextvars
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+import torch
+
+from config import TRACE_JSON_LOGS, STAGE_LATENCY_BUCKETS
+
+# Set per HTTP request and carried into jobs (the scheduler runs jobs in the submitting request's context).
+request_id_var: contextvars.ContextVar[str | None] = contextvars.ContextVar("request_id", default=None)
+
+
+def _label_str(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = ['%s="%s"' % (n, str(v).replace('\\', '\\\\').replace('"', '\\"')) for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...] = ()):
+        self.name, self.help, self.label_names = name, help_text, label_names
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_label_str(self.label_names, key)} {_format_value(value)}" for key, value in items]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = STAGE_LATENCY_BUCKETS):
+        self.name, self.help, self.label_names, self.buckets = name, help_text, label_names, buckets
+        self._series: dict[tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.label_names)
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in items:
+            labels = _label_str(self.label_names, key)
+            for bound, bucket_count in zip(self.buckets, counts):
+                bucket_labels = _label_str(self.label_names, key, 'le="%s"' % _format_value(bound))
+                lines.append(f"{self.name}_bucket{bucket_labels} {bucket_count}")
+            inf_labels = _label_str(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf_labels} {count}")
+            lines.append(f"{self.name}_sum{labels} {total:.6f}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds counters and histograms, plus collectors that report point-in-time values (gauges) at scrape time."""
+
+    def __init__(self):
+        self._metrics: list[Counter | Histogram] = []
+        self._collectors: list[Callable[[], list[tuple[str, str, str, dict[str, str], float]]]] = []
+
+    def counter(self, name: str, help_text: str, label_names: tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help_text, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, label_names: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = STAGE_LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, label_names, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], list[tuple[str, str, str, dict[str, str], float]]]) -> None:
+        """`collector()` returns `(name, type, help, labels, value)` samples; it runs on every scrape."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        # The exposition format wants each metric's samples in one block, so group across collectors first.
+        families: dict[str, tuple[str, str, list[str]]] = {}
+        for collector in self._collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+                continue
+            for name, metric_type, help_text, labels, value in samples:
+                family = families.setdefault(name, (metric_type, help_text, []))
+                family[2].append(f"{name}{_label_str(tuple(labels), tuple(labels.values()))} {_format_value(value)}")
+        for name, (metric_type, help_text, sample_lines) in families.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}", *sample_lines]
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+STAGE_SECONDS = registry.histogram("app_stage_duration_seconds", "Time spent in each pipeline stage.", ("stage",))
+REQUESTS = registry.counter("app_http_requests_total", "HTTP requests by endpoint and status code.", ("endpoint", "status"))
+REQUEST_SECONDS = registry.histogram("app_http_request_duration_seconds", "HTTP handler latency (excludes queued job time).", ("endpoint",))
+DETECTED_OBJECTS = registry.counter("app_detected_objects_total", "Objects kept after mask filtering.")
+AI_EDIT_RESULTS = registry.counter("app_ai_edit_results_total", "Enhanced AI edits by outcome.", ("outcome",))
+SAM_DECODE_PEAK_BYTES = registry.histogram(
+    "app_sam_decode_peak_bytes", "Peak transient memory of SAM mask decoding per image (estimated on CPU).",
+    buckets=tuple(float(2 ** n * 1024 ** 2) for n in range(4, 13)),
+)
+
+
+def log_event(event: str, **fields) -> None:
+    """Writes one structured JSON log line when TRACE_JSON_LOGS is enabled."""
+    if not TRACE_JSON_LOGS:
+        return
+    record = {"ts": round(time.time(), 3), "event": event, "request_id": request_id_var.get(), **fields}
+    print(json.dumps(record, default=str), flush=True)
+
+
+@contextmanager
+def span(stage: str, **fields):
+    """Times a pipeline stage into `app_stage_duration_seconds` and, optionally, a JSON log line."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start, **fields)
+
+
+def observe_stage(stage: str, seconds: float, **fields) -> None:
+    """Records a stage duration measured by the caller, e.g. one summed over interleaved chunks."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    log_event("span", stage=stage, seconds=round(seconds, 5), **fields)
+
+
+def process_rss_bytes() -> int:
+    """Current resident set size; falls back to the peak where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _process_samples():
+    samples = [
+        ("process_resident_memory_bytes", "gauge", "Resident memory size in bytes.", {}, process_rss_bytes()),
+        ("process_peak_resident_memory_bytes", "gauge", "Peak resident memory size in bytes.", {},
+         resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024),
+    ]
+    if torch.cuda.is_available():
+        samples += [
+            ("torch_cuda_memory_allocated_bytes", "gauge", "Memory held by live CUDA tensors.", {}, torch.cuda.memory_allocated()),
+            ("torch_cuda_memory_reserved_bytes", "gauge", "Memory reserved by the CUDA caching allocator.", {}, torch.cuda.memory_reserved()),
+        ]
+    return samples
+
+
+registry.add_collector(_process_samples)
+
+
+def cache_collector(name: str, cache) -> Callable:
+    """Collector exposing a cache's `stats()` hit/miss counters (and size, when reported)."""
+    def collect():
+        stats = cache.stats()
+        if not stats:
+            return []
+        samples = [
+            ("app_cache_hits_total", "counter", "Cache lookups that hit.", {"cache": name}, stats["hits"]),
+            ("app_cache_misses_total", "counter", "Cache lookups that missed.", {"cache": name}, stats["misses"]),
+        ]
+        if "bytes" in stats:
+            samples.append(("app_cache_bytes", "gauge", "Bytes held by the cache.", {"cache": name}, stats["bytes"]))
+        return samples
+    return collect